@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cleaning import LOCAL_KINDS, apply_spec, clean_frame, split_spec
+from src.ffc_db import FFC_DB
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def estimate(df, specs, jobs: int) -> float:
+    # Times every pool task on its own and packs them longest first onto
+    # jobs workers, the parent runs the local columns meanwhile. Leaves out
+    # the pool start up, so it is a lower bound where cores are missing.
+    local = sum(timed(apply_spec, df, [column for column in spec if column[2] in LOCAL_KINDS]) for spec in specs)
+    tasks = [part for spec in specs for part in split_spec([column for column in spec if column[2] not in LOCAL_KINDS], jobs)]
+    workers = [0.0] * jobs
+    for task in sorted((timed(apply_spec, df, task) for task in tasks), reverse=True):
+        workers[workers.index(min(workers))] += task
+    return max(local, max(workers))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compares serial and parallel cleaning of the raw FFCdb sheet.")
+    parser.add_argument("-c", "--config", default="constants.toml", help="Config file pointing at the raw data.")
+    parser.add_argument("-j", "--jobs", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to benchmark.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per worker count, the best one is reported.")
+    parser.add_argument("-s", "--scale", type=int, default=1, help="Repeats the raw rows to emulate a larger release.")
+    args = parser.parse_args()
+
+    db = FFC_DB(config=args.config)
+    df = db.read_raw_data()
+    if args.scale > 1:
+        df = df.loc[df.index.repeat(args.scale)].reset_index(drop=True)
+    specs = db._cleaning_specs(df.columns)
+    print(f"cpus={os.cpu_count()}")
+
+    baseline = None
+    for jobs in args.jobs:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            clean_frame(df, specs, jobs)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        baseline = baseline or best
+        line = f"jobs={jobs:<3} rows={len(df):<8} best={best:.3f}s speedup={baseline / best:.2f}x"
+        if jobs > 1:
+            line += f" estimated={estimate(df, specs, jobs):.3f}s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
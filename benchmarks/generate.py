@@ -0,0 +1,104 @@
+import argparse
+import os
+import random
+import sys
+from typing import Dict, List
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cleaning import LISTS_COLUMNS, MATERIAL_COLUMNS, MATERIALS, MOST_VALUABLE_COLUMNS, NO, NOT_LISTED, SOURCE_COLUMNS, YES, spec_sources
+
+# Row count of the 2020 Zenodo release, used as the 1x scale.
+BASE_ROWS = 12_285
+BASE_SOURCES = 67
+SHEET_NAME = "FCCdb_FINAL_LIST"
+
+CAS_HEADER = "CAS \nnumber or CFSAN id"
+MATERIAL_COUNT_HEADER = MATERIAL_COLUMNS[0][0]
+SOURCE_COUNT_HEADER = SOURCE_COLUMNS[0][0]
+# Columns of the real sheet the cleaning code does not read.
+EXTRA_HEADERS = ["Defined use", "Comment"]
+
+# Values for headers whose content matters to a transform, other headers
+# fall back to values picked by the kind of their spec.
+VALUES: Dict[str, list] = {
+    "CAS \nvalidity": ["valid", "valid", "valid", "invalid"],
+    "Synonyms, \nas used by other sources": [NOT_LISTED, "syn a", "syn a; syn b", "syn a; syn b; syn c"],
+    "Registered under REACH? + tonnage": [NO, f"{YES}; 10 - 100", f"{YES}; 1000 - 10000; 100+", f"{YES}; 1+", f"{YES}; 100 - 1000; 10 - 100", f"{YES}; 0 - 10"],
+    "included in the CPPdb?\n + List A or B status and if considered fc (assessed for ListA only)": [NO, NO, f"{YES}; List A; fc", f"{YES}; List B", f"{YES}; List A; not fc"],
+    "SIN \nList's use groups": [NOT_LISTED, NOT_LISTED, "Food contact materials", "Plastics, FOOD packaging", "Cosmetics"],
+    "PMT/vPvM classification by UBA 2019 report + Assessment quality": [NOT_LISTED, "PMT; high quality", "vPvM; low quality"],
+    "Genotoxicity Calls from EFSA OpenFoodTox database": [NOT_LISTED, "positive", "negative"],
+}
+KIND_VALUES: Dict[str, list] = {
+    "yes_no": [NO, NO, NO, f"{YES}; reason A", f"{YES}; Evaluation; Concluded; 2019; FR", f"{YES}; Annex XIV; entry 12"],
+    "numeric": [NOT_LISTED, 0, 1, 3, 7, 12],
+    "listed": [NOT_LISTED, NOT_LISTED, "Danger", "Warning", "Carc. 1B; H350", "Acute Tox. 4; H302; Aquatic Chronic 2; H411"],
+    "copy": [NOT_LISTED, "group A", "group B"],
+}
+
+
+def spec_headers() -> List[str]:
+    return spec_sources(MOST_VALUABLE_COLUMNS + MATERIAL_COLUMNS + SOURCE_COLUMNS + LISTS_COLUMNS)
+
+
+def headers(sources: int = BASE_SOURCES) -> List[str]:
+    return spec_headers() + EXTRA_HEADERS + [f"Global \nInventory: {material}" for material in MATERIALS] + [f"S{i}" for i in range(1, sources + 1)]
+
+
+def _header_values() -> Dict[str, list]:
+    values = {}
+    for source, _, kind in MOST_VALUABLE_COLUMNS + LISTS_COLUMNS:
+        for header in (source if isinstance(source, tuple) else (source,)):
+            values.setdefault(header, VALUES.get(header, KIND_VALUES.get(kind, KIND_VALUES["copy"])))
+    return values
+
+
+def generate_workbook(path: str, rows: int = BASE_ROWS, sources: int = BASE_SOURCES, seed: int = 0, material_rate: float = 0.2, source_rate: float = 0.05) -> None:
+    """Writes an FFCdb-like workbook with the exact headers the cleaning
+    code expects and random but realistic values."""
+    rng = random.Random(seed)
+    values = _header_values()
+    fixed = spec_headers()
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_NAME)
+    sheet.append(headers(sources))
+
+    for i in range(rows):
+        materials = [1 if rng.random() < material_rate else 0 for _ in MATERIALS]
+        mentions = [f"S{k} ref" if rng.random() < source_rate else 0 for k in range(1, sources + 1)]
+
+        row = []
+        for header in fixed:
+            if header == CAS_HEADER:
+                row.append(f"{rng.randint(50, 999999)}-{rng.randint(10, 99)}-{rng.randint(0, 9)}")
+            elif header == "Name":
+                row.append(f"substance {i} {rng.choice(['acid', 'oxide', 'ester', 'amine'])}")
+            elif header == MATERIAL_COUNT_HEADER:
+                row.append(sum(materials))
+            elif header == SOURCE_COUNT_HEADER:
+                row.append(sum(1 for mention in mentions if mention))
+            else:
+                row.append(rng.choice(values[header]))
+
+        sheet.append(row + [rng.choice(["Defined Use", "Undefined Use"]), rng.random()] + materials + mentions)
+
+    workbook.save(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generates synthetic FFCdb workbooks for benchmarks.")
+    parser.add_argument("path", help="Output xlsx file.")
+    parser.add_argument("-s", "--scale", type=float, default=1, help=f"Row count as a multiple of the {BASE_ROWS} rows of the real release.")
+    parser.add_argument("-src", "--sources", type=int, default=BASE_SOURCES, help="Number of S<n> source columns.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    generate_workbook(args.path, int(BASE_ROWS * args.scale), args.sources, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ffc_db import FFC_DB
+from src.lookup import COLUMNS, SubstanceIndex, normalize_name
+
+
+def typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(len(name))
+    return rng.choice([name[:i] + name[i + 1:], name[:i] + rng.choice("aeiounst") + name[i + 1:]])
+
+
+def scan(df: pd.DataFrame, query: str) -> list:
+    # What finding a substance takes without the index.
+    return df.index[(df["CAS/CFSAN number"] == query) | (df["Name"] == query) | df["Synonyms"].str.contains(query, regex=False)].tolist()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Times building, loading and batch queries of the substance lookup index against a full scan of the cleaned data.")
+    parser.add_argument("-c", "--config", default="constants.toml", help="Config file pointing at the cleaned data.")
+    parser.add_argument("-q", "--queries", type=int, default=2000, help="Number of names with one typo to look up.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for sampled names and typos.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    df = FFC_DB(config=args.config).get_clean_data(COLUMNS)
+    rows = [rng.randrange(len(df)) for _ in range(args.queries)]
+    names = [df["Name"].iloc[row] for row in rows]
+
+    start = time.perf_counter()
+    index = SubstanceIndex.from_frame(df)
+    print(f"build            {time.perf_counter() - start:.3f}s terms={len(index.terms)} grams={len(index.grams)}")
+
+    path = os.path.join(tempfile.gettempdir(), "lookup_index.npz")
+    index.save(path)
+    start = time.perf_counter()
+    index = SubstanceIndex.load(path)
+    print(f"load             {time.perf_counter() - start:.3f}s size={os.path.getsize(path) / 2**20:.1f}MB")
+    os.remove(path)
+
+    sample = names[:min(len(names), 200)]
+    start = time.perf_counter()
+    for name in sample:
+        scan(df, name)
+    per_query = (time.perf_counter() - start) / len(sample)
+    print(f"scan exact       {per_query * len(names):.3f}s for {len(names)} names (estimated from {len(sample)})")
+
+    start = time.perf_counter()
+    index.lookup_many(names)
+    print(f"index exact      {time.perf_counter() - start:.3f}s for {len(names)} names")
+
+    # A typo is found when the sampled substance or one with the same
+    # normalized name comes first.
+    typos = [typo(name, rng) for name in names]
+    start = time.perf_counter()
+    matches = index.lookup_many(typos)
+    elapsed = time.perf_counter() - start
+    found = sum(
+        pd.notna(match.row) and normalize_name(index.names[match.row]) == normalize_name(name)
+        for match, name in zip(matches.itertuples(index=False), names)
+    )
+    print(f"index fuzzy      {elapsed:.3f}s for {len(typos)} names, top match right for {found / len(typos):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import BASE_ROWS, BASE_SOURCES, SHEET_NAME, generate_workbook
+from src.ffc_db import FFC_DB, REGRESSION_COLUMNS
+
+
+def timed(function: Callable[[], object]) -> Dict[str, float]:
+    start = time.perf_counter()
+    function()
+    return {"seconds": round(time.perf_counter() - start, 4)}
+
+
+def traced(function: Callable[[], object]) -> Dict[str, float]:
+    # tracemalloc sees numpy and Python allocations, not the pyarrow memory pool.
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"peak_mb": round(peak / 2**20, 2)}
+
+
+def write_config(folder: str, xlsx_path: str) -> str:
+    path = os.path.join(folder, "constants.toml")
+    data_folder = os.path.join(folder, "data")
+    with open(path, "w") as f:
+        f.write(f'data_folder = {json.dumps(data_folder)}\n')
+        f.write(f'ffc_db_file = {json.dumps(xlsx_path)}\n')
+        f.write(f'cleaned_file = {json.dumps(os.path.join(data_folder, "FFCdb_clean.parquet"))}\n')
+        f.write(f'data_sheet_name = "{SHEET_NAME}"\n')
+    return path
+
+
+def run_stages(db: FFC_DB, measure: Callable[[Callable[[], object]], Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    from src.visualization import prepare_data_for_material_plots
+
+    shutil.rmtree(db.raw_folder, ignore_errors=True)
+    shutil.rmtree(os.path.join(db.config.get("data_folder"), "correlations"), ignore_errors=True)
+    shutil.rmtree(db.figure_cache_folder, ignore_errors=True)
+
+    data = {}
+    results = {
+        "read_raw": measure(db.read_raw_data),
+        "read_raw_snapshot": measure(db.read_raw_data),
+        "clean_data": measure(db.clean_data),
+        "get_clean_data": measure(lambda: data.setdefault("df", db.get_clean_data())),
+    }
+    df = data["df"]
+    results["prepare_data_for_material_plots"] = measure(lambda: prepare_data_for_material_plots(df))
+    results["save_correlations"] = measure(lambda: db.save_correlations(df))
+    results["run_regression"] = measure(lambda: db.run_regression(df[REGRESSION_COLUMNS], save_model=True))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(history: List[dict], rows: int, sources: int) -> Optional[dict]:
+    for run in reversed(history):
+        if run["rows"] == rows and run["sources"] == sources:
+            return run
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks every pipeline stage on synthetic FFCdb workbooks and appends wall time and peak memory to a JSON history.")
+    parser.add_argument("-s", "--scales", type=float, nargs="+", default=[1], help=f"Row counts as multiples of the {BASE_ROWS} rows of the real release, e.g. 1 10 100.")
+    parser.add_argument("-src", "--sources", type=int, default=BASE_SOURCES, help="Number of S<n> source columns.")
+    parser.add_argument("-w", "--work-dir", default=os.path.join(tempfile.gettempdir(), "ffcdb_benchmarks"), help="Folder for generated workbooks and stage outputs, workbooks are reused between runs.")
+    parser.add_argument("-o", "--history", default=os.path.join(ROOT, "benchmarks", "history.json"), help="JSON file the results are appended to.")
+    parser.add_argument("-nm", "--no-memory", action="store_true", help="Skips the second pass that measures peak memory with tracemalloc.")
+    parser.add_argument("-ms", "--max-slowdown", type=float, default=None, help="Exits with an error when a stage is this many times slower than the previous run of the same size.")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history, "r") as f:
+            history = json.load(f)
+
+    regressions = []
+    for scale in args.scales:
+        rows = int(BASE_ROWS * scale)
+        xlsx_path = os.path.join(args.work_dir, f"ffcdb_{rows}r_{args.sources}s.xlsx")
+        if not os.path.exists(xlsx_path):
+            print(f"Generating {xlsx_path}")
+            generate_workbook(xlsx_path, rows, args.sources)
+
+        # Stages write correlations, model and figures to the working directory.
+        folder = os.path.join(args.work_dir, f"{rows}r_{args.sources}s")
+        os.makedirs(folder, exist_ok=True)
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            db = FFC_DB(config=write_config(folder, os.path.abspath(xlsx_path)))
+            # tracemalloc slows allocation heavy stages several times, so
+            # time and memory come from separate passes.
+            results = run_stages(db, timed)
+            if not args.no_memory:
+                for stage, result in run_stages(db, traced).items():
+                    results[stage].update(result)
+        finally:
+            os.chdir(cwd)
+
+        previous = previous_run(history, rows, args.sources)
+        for stage, result in results.items():
+            change = ""
+            if previous and stage in previous["stages"]:
+                ratio = result["seconds"] / max(previous["stages"][stage]["seconds"], 1e-9)
+                change = f" ({ratio:.2f}x previous)"
+                if args.max_slowdown and ratio > args.max_slowdown:
+                    regressions.append(f"{stage} at {rows} rows is {ratio:.2f}x slower")
+            memory = f" {result['peak_mb']:>9.1f}MB" if "peak_mb" in result else ""
+            print(f"rows={rows:<8} {stage:<32} {result['seconds']:>9.3f}s{memory}{change}")
+
+        history.append({
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "rows": rows,
+            "sources": args.sources,
+            "stages": results,
+        })
+
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=2)
+
+    if regressions:
+        print("\n".join(["Slower than previous run:"] + regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = ["download", "clean", "corr", "plot", "train", "run", "score", "query", "lookup", "sql", "releases", "diff", "memory"]
+
+# Modules no command should load before it runs.
+HEAVY_MODULES = ["sklearn", "matplotlib", "seaborn", "scipy", "joblib", "requests", "openpyxl"]
+
+
+def best_time(command: list, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def loaded_heavy_modules(module: str) -> list:
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+    return result.stdout.split()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Checks that the CLI starts within a time budget and loads heavy dependencies lazily.")
+    parser.add_argument("-b", "--budget", type=float, default=0.5, help="Allowed seconds for `start.py [command] --help`.")
+    parser.add_argument("-ib", "--import-budget", type=float, default=1.5, help="Allowed seconds for `import src.ffc_db`.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per measurement, the best one is compared to the budget.")
+    args = parser.parse_args()
+
+    failures = []
+
+    for command in [[]] + [[name] for name in COMMANDS]:
+        best = best_time([sys.executable, "start.py"] + command + ["--help"], args.repeat)
+        name = " ".join(["start.py"] + command + ["--help"])
+        print(f"{name:<30} best={best:.3f}s budget={args.budget:.3f}s")
+        if best > args.budget:
+            failures.append(f"{name} took {best:.3f}s")
+
+    best = best_time([sys.executable, "-c", "import src.ffc_db"], args.repeat)
+    print(f"{'import src.ffc_db':<30} best={best:.3f}s budget={args.import_budget:.3f}s")
+    if best > args.import_budget:
+        failures.append(f"import src.ffc_db took {best:.3f}s")
+
+    for module in ["start", "src.ffc_db"]:
+        heavy = loaded_heavy_modules(module)
+        if heavy:
+            failures.append(f"import {module} loads {', '.join(heavy)}")
+
+    if failures:
+        print("\n".join(["Startup budget exceeded:"] + failures))
+        sys.exit(1)
+
+    print("Startup budget met.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import fnmatch
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_OPERATORS = "&|~()"
+
+
+class QueryError(Exception):
+    pass
+
+
+class BitmapIndex:
+    """One packed bitmap per boolean flag of the cleaned data.
+
+    Bitmaps are stored as uint64 words, so the boolean operators work on
+    64 substances at a time and counts come from a byte popcount table.
+    """
+
+    def __init__(self, bitmaps: Dict[str, np.ndarray], size: int) -> None:
+        self.bitmaps = bitmaps
+        self.size = size
+        self._mask = self._pack(np.ones(size, dtype=bool))
+
+    @staticmethod
+    def _pack(values: np.ndarray) -> np.ndarray:
+        packed = np.packbits(values, bitorder="little")
+        padding = -len(packed) % 8
+        return np.concatenate([packed, np.zeros(padding, dtype=np.uint8)]).view(np.uint64)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: Optional[Iterable[str]] = None) -> "BitmapIndex":
+        columns = list(columns) if columns is not None else flag_columns(df)
+        bitmaps = {column: cls._pack(df[column].fillna(False).to_numpy(dtype=bool)) for column in columns}
+        return cls(bitmaps, len(df))
+
+    @classmethod
+    def load(cls, path: str) -> "BitmapIndex":
+        with np.load(path, allow_pickle=False) as data:
+            names = [str(name) for name in data["names"]]
+            matrix = data["bitmaps"]
+            size = int(data["size"])
+        return cls(dict(zip(names, matrix)), size)
+
+    def save(self, path: str) -> None:
+        names = list(self.bitmaps)
+        matrix = np.stack([self.bitmaps[name] for name in names]) if names else np.zeros((0, len(self._mask)), dtype=np.uint64)
+        with open(path, "wb") as f:
+            np.savez(f, names=np.array(names), bitmaps=matrix, size=np.array(self.size))
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.bitmaps)
+
+    def bitmap(self, name: str) -> np.ndarray:
+        if name in self.bitmaps:
+            return self.bitmaps[name]
+
+        matches = fnmatch.filter(self.bitmaps, name)
+        if not matches:
+            raise QueryError(f"Unknown flag: {name!r}")
+
+        result = np.zeros_like(self._mask)
+        for match in matches:
+            result |= self.bitmaps[match]
+        return result
+
+    def popcount(self, bits: np.ndarray) -> int:
+        return int(_POPCOUNT[bits.view(np.uint8)].sum(dtype=np.int64))
+
+    def to_rows(self, bits: np.ndarray) -> np.ndarray:
+        values = np.unpackbits(bits.view(np.uint8), bitorder="little", count=self.size)
+        return np.flatnonzero(values)
+
+    def query(self, expression: str) -> np.ndarray:
+        return _Parser(self, expression).parse()
+
+    def count(self, expression: str) -> int:
+        return self.popcount(self.query(expression))
+
+    def rows(self, expression: str) -> np.ndarray:
+        return self.to_rows(self.query(expression))
+
+    def at_least(self, k: int, columns: Optional[Iterable[str]] = None) -> np.ndarray:
+        # Bit-sliced counter: planes[i] holds bit i of every substance's count.
+        planes: List[np.ndarray] = []
+        for column in (columns if columns is not None else self.bitmaps):
+            carry = self.bitmap(column)
+            for i, plane in enumerate(planes):
+                planes[i], carry = plane ^ carry, plane & carry
+            if carry.any():
+                planes.append(carry)
+
+        if k <= 0:
+            return self._mask.copy()
+        if k.bit_length() > len(planes):
+            return np.zeros_like(self._mask)
+
+        greater = np.zeros_like(self._mask)
+        equal = self._mask.copy()
+        for i in reversed(range(len(planes))):
+            if k >> i & 1:
+                equal &= planes[i]
+            else:
+                greater |= equal & planes[i]
+                equal &= ~planes[i]
+        return greater | equal
+
+    def count_at_least(self, k: int, columns: Optional[Iterable[str]] = None) -> int:
+        return self.popcount(self.at_least(k, columns))
+
+
+class _Parser:
+    # expression := term ("|" term)*
+    # term       := factor ("&" factor)*
+    # factor     := "~" factor | "(" expression ")" | flag
+    def __init__(self, index: BitmapIndex, expression: str) -> None:
+        self.index = index
+        self.tokens = self._tokenize(expression)
+        self.position = 0
+
+    def _tokenize(self, expression: str) -> List[str]:
+        names = sorted(self.index.bitmaps, key=len, reverse=True)
+        tokens = []
+        i = 0
+        while i < len(expression):
+            char = expression[i]
+            if char.isspace():
+                i += 1
+            elif char in "\"'`":
+                end = expression.find(char, i + 1)
+                if end == -1:
+                    raise QueryError(f"Unterminated quote at position {i}")
+                tokens.append(("name", expression[i + 1:end]))
+                i = end + 1
+            elif char in _OPERATORS:
+                tokens.append(("op", char))
+                i += 1
+            else:
+                # Prefer known flag names so names such as "A&I Materials" stay whole.
+                for name in names:
+                    end = i + len(name)
+                    if expression.startswith(name, i) and (end == len(expression) or expression[end].isspace() or expression[end] in "&|)"):
+                        tokens.append(("name", name))
+                        i = end
+                        break
+                else:
+                    end = i
+                    while end < len(expression) and expression[end] not in _OPERATORS:
+                        end += 1
+                    tokens.append(("name", expression[i:end].strip()))
+                    i = end
+        return tokens
+
+    def _peek(self) -> Optional[tuple]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self) -> tuple:
+        token = self._peek()
+        if token is None:
+            raise QueryError("Unexpected end of query")
+        self.position += 1
+        return token
+
+    def parse(self) -> np.ndarray:
+        result = self._expression()
+        if self._peek() is not None:
+            raise QueryError(f"Unexpected token {self._peek()[1]!r}")
+        return result
+
+    def _expression(self) -> np.ndarray:
+        result = self._term()
+        while self._peek() == ("op", "|"):
+            self._next()
+            result = result | self._term()
+        return result
+
+    def _term(self) -> np.ndarray:
+        result = self._factor()
+        while self._peek() == ("op", "&"):
+            self._next()
+            result = result & self._factor()
+        return result
+
+    def _factor(self) -> np.ndarray:
+        kind, value = self._next()
+        if kind == "name":
+            return self.index.bitmap(value)
+        if value == "~":
+            return ~self._factor() & self.index._mask
+        if value == "(":
+            result = self._expression()
+            if self._next() != ("op", ")"):
+                raise QueryError("Missing closing parenthesis")
+            return result
+        raise QueryError(f"Unexpected token {value!r}")
+
+
+def flag_columns(df: pd.DataFrame) -> List[str]:
+    return [
+        column for column in df.columns
+        if pd.api.types.is_bool_dtype(df[column]) or pd.api.types.infer_dtype(df[column], skipna=True) == "boolean"
+    ]
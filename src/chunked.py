@@ -0,0 +1,125 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.cleaning import ColumnSpec, clean_frame, spec_sources
+
+CHUNK_ROWS = 50_000
+INVENTORY_COLUMN = "Inventory"
+
+# Output type of every transform kind. Chunks infer their own dtypes, so the
+# store gets one schema up front instead of the first chunk's guess.
+KIND_TYPES = {
+    "copy": pa.string(),
+    "valid": pa.bool_(),
+    "yes_no": pa.bool_(),
+    "numeric": pa.float64(),
+    "listed": pa.string(),
+    "max_tonnage": pa.float64(),
+    "min_tonnage": pa.float64(),
+    "has_fc": pa.bool_(),
+    "contains_food": pa.bool_(),
+    "food_contact": pa.bool_(),
+    "int": pa.int64(),
+    "flag": pa.bool_(),
+}
+
+
+def spec_schema(specs: List[List[ColumnSpec]], inventory: bool = False) -> pa.Schema:
+    fields = [(INVENTORY_COLUMN, pa.string())] if inventory else []
+    fields += [(target, KIND_TYPES[kind]) for spec in specs for _, target, kind in spec]
+    return pa.schema(fields)
+
+
+def frame_to_table(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    df = df.reindex(columns=schema.names)
+    for field in schema:
+        if pa.types.is_string(field.type):
+            column = df[field.name]
+            df[field.name] = np.where(column.isna(), None, column.astype(str))
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def clean_chunk(df: pd.DataFrame, specs: List[List[ColumnSpec]]) -> pd.DataFrame:
+    # Columns missing from an inventory become empty ones, except material
+    # and source flags, where a missing column means "not included".
+    flags = {source for spec in specs for source, _, kind in spec if kind == "flag"}
+    missing = [name for name in spec_sources([column for spec in specs for column in spec]) if name not in df.columns]
+    if missing:
+        df = pd.concat([df, pd.DataFrame({name: 0 if name in flags else np.nan for name in missing}, index=df.index)], axis=1)
+        # A missing count is recounted from the flags of its group, the
+        # "int" transform cannot take blanks.
+        for spec in specs:
+            counted = [source for source, _, kind in spec if kind == "flag"]
+            for source, _, kind in spec:
+                if kind == "int" and source in missing:
+                    df[source] = df[counted].ne(0).sum(axis=1)
+
+    # A column that is empty in the whole chunk is read as float, but the
+    # string transforms need objects.
+    empty = [name for name in df.columns if df[name].isna().all()]
+    df[empty] = df[empty].astype(object)
+    return clean_frame(df, specs)
+
+
+def clean_chunks(chunks: Iterable[pd.DataFrame], specs: List[List[ColumnSpec]], jobs: int = 1) -> Iterator[pd.DataFrame]:
+    if jobs <= 1:
+        for chunk in chunks:
+            yield clean_chunk(chunk, specs)
+        return
+
+    # At most two chunks per worker are in flight, so memory stays bounded.
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(clean_chunk, chunk, specs))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class ChunkWriter:
+    """Appends cleaned chunks to a Parquet or csv file with a fixed schema.
+    The file is written next to the target and only replaces it on success."""
+
+    def __init__(self, path: str, schema: pa.Schema) -> None:
+        self.path = path
+        self.schema = schema
+        self.rows = 0
+        self._temp_path = f"{path}.tmp"
+        self._writer: Optional[pq.ParquetWriter] = None
+
+    @property
+    def is_csv(self) -> bool:
+        return self.path.endswith(".csv")
+
+    def __enter__(self) -> "ChunkWriter":
+        if self.is_csv:
+            self.schema.empty_table().to_pandas().to_csv(self._temp_path, index=False)
+        else:
+            self._writer = pq.ParquetWriter(self._temp_path, self.schema)
+        return self
+
+    def write(self, df: pd.DataFrame) -> None:
+        table = frame_to_table(df, self.schema)
+        if self.is_csv:
+            table.to_pandas().to_csv(self._temp_path, mode="a", header=False, index=False)
+        else:
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+        if exc_type is None:
+            os.replace(self._temp_path, self.path)
+        elif os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
@@ -0,0 +1,220 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+YES = "yes"
+NO = "no"
+NOT_LISTED = "not listed"
+
+MATERIALS = [
+    "Plastics",
+    "Coatings",
+    "Rubber",
+    "Silicones",
+    "Ion-Exchange Resins",
+    "Paper/Board",
+    "Cellophane",
+    "Textiles",
+    "Cork and Wood",
+    "Adhesives",
+    "Colorants",
+    "Printing Inks",
+    "Wax",
+    "Inorganics",
+    "A&I Materials",
+    "Other Uses",
+]
+
+# (source header(s), target name, transform kind)
+ColumnSpec = Tuple[Union[str, Tuple[str, ...]], str, str]
+
+TONNAGE_PATTERN = r"(?:^|; )(\d+)(?:\s*-\s*(\d+))?"
+
+MOST_VALUABLE_COLUMNS: List[ColumnSpec] = [
+    ("CAS \nvalidity", "CAS validity", "valid"),
+    ("CAS \nnumber or CFSAN id", "CAS/CFSAN number", "copy"),
+    ("Name", "Name", "copy"),
+    ("Synonyms, \nas used by other sources", "Synonyms", "copy"),
+    ("Priority hazardous substance prioritized based on selected authoritative sources? + why", "Hazardous auth", "yes_no"),
+    ("Substance of potential concern identified based on selected non-authoritative sources? + why", "Potential concern non-auth", "yes_no"),
+    ("ECHA \nC&L: \nSUM HH", "ECHA: HH", "numeric"),
+    ("ECHA \nC&L: SUM ENVH", "ECHA: ENVH", "numeric"),
+    ("ECHA \nC&L: Signal Word", "ECHA: Signal Word", "listed"),
+    ("ECHA \nC&L: \nClassification", "ECHA: Classification", "listed"),
+    ("GHS-J: \nSUM HH", "GHS-J: HH", "numeric"),
+    ("GHS-J: \nSUM ENVH", "GHS-J: ENVH", "numeric"),
+    ("GHS-J: \nSignal Word", "GHS-J: Signal Word", "listed"),
+    ("GHS-J: \nClassification", "GHS-J: Classification", "listed"),
+    ("Danish \nEPA's predicted GHS-aligned classifications for HH or ENVH", "GHS-aligned classifications", "listed"),
+    ("predicted priority HH: potential CMR substance based on the Danish EPA's predicted GHS-aligned classifications? + which classifications decisive", "GHS-aligned HH priority", "listed"),
+    ("predicted priority ENVH: Class 1 Aq. Chronic with or without Aq. Acute 1 toxicant based on the Danish EPA's predicted GHS-aligned classifications? + which classifications decisive", "GHS-aligned ENVH priority", "listed"),
+    ("Registered under REACH? + tonnage", "max_tonnage", "max_tonnage"),
+    ("Registered under REACH? + tonnage", "min_tonnage", "min_tonnage"),
+    ("included in the CPPdb?\n + List A or B status and if considered fc (assessed for ListA only)", "CPPdb food contact", "has_fc"),
+    ("SIN \nList's use groups", "SIN food contact", "contains_food"),
+    (("SIN \nList's use groups", "included in the CPPdb?\n + List A or B status and if considered fc (assessed for ListA only)"), "food_contact", "food_contact"),
+    ("SIN \nList's use groups", "SIN groups", "copy"),
+    ("PMT/vPvM classification by UBA 2019 report + Assessment quality", "PMT/vPvM UBA", "copy"),
+]
+
+LISTS_COLUMNS: List[ColumnSpec] = [
+    ("EDC,  REACH classification", "EDC REACH", "yes_no"),
+    ("Included on the EU Endocrine Disruptor Lists? + List type", "EDC EU", "yes_no"),
+    ("Included on the ECHA's Endocrine disruptor assessment list? + Status + Outcome + Follow-up + Authority", "EDC ECHA", "yes_no"),
+    ("EDC included in \n2018 UNEP report?", "EDC UNEP", "yes_no"),
+    ("EDC \non TEDX list?", "EDC TEDX", "yes_no"),
+    ("EDC recognized in the EU under REACH or Biocides regulation", "EDC REACH/Biociedes requlations", "yes_no"),
+    ("PBT \nor vPvB or POP? (EU, US)", "PBT/vPvB/POP EU US", "yes_no"),
+    ("On ECHA's PBT assessment list? + Status + Outcome + Follow-up + Assessment date + Authority", "PBT ECHA", "yes_no"),
+    ("On EU \nREACH \nSVHC list (Candidate list for authorization)? + reasons for inclusion", "SVHC REACH", "yes_no"),
+    ("On EU \nREACH \nAuthorization list, Annex XIV? + reasons for inclusion", "Authorization list REACH", "yes_no"),
+    ("On EU \nREACH Restriction list, Annex XVII? + entry number", "Restriction list REACH", "yes_no"),
+    ("on Cal \nProp65 List? + indicated toxicity", "Cal Prop65", "yes_no"),
+    ("on EU CoRAP list? + Status + Initial grounds for concern + Year + Evaluating Member State", "CoRAP EU", "yes_no"),
+    ("In EFSA's Open Food Tox database?", "OpenFoodToxDB EFSA", "yes_no"),
+    ("Genotoxicity Calls from EFSA OpenFoodTox database", "Genotoxicity OFTDB EFSA", "copy"),
+    ("on EPA's \nsafer \nchemical ingredients \nlist?", "SCI EPA", "yes_no"),
+    ("Substances \nof genotoxic concern, prioritized by van Bossuyt et al. 2017, 2018", "Genotoxic concer by van Bossuyt", "yes_no"),
+    ("on \nSIN list?\n + reasons for inclusion", "SIN", "yes_no"),
+    ("In ToxVal\ndatabase? + N DataSources; N PubmedArticles; N PubchemDataSources; N CPDatCount", "ToxValDB", "yes_no"),
+    ("Registered under REACH? + tonnage", "Registerd REACH", "yes_no"),
+    ("on the REACH Chemical Universe Mapping list? + Tonnage + Registration Status + Position in the chemical universe", "Chemical Universe Mapping REACH", "yes_no"),
+    ("on ECHA's \nplastics additives list? + main function indicated by ECHA", "Plastics additives ECHA", "yes_no"),
+    ("included in the CPPdb?\n + List A or B status and if considered fc (assessed for ListA only)", "CPPdb", "yes_no"),
+    ("on TSCA \ninventory? + status", "TSCA", "yes_no"),
+    ("on New \nZealand list of chemicals (NZIOC)? + conditions", "NZIOC", "yes_no"),
+]
+
+LIST_FLAGS = [target for _, target, kind in LISTS_COLUMNS if kind == "yes_no"]
+
+MATERIAL_PATTERN = re.compile(r"^Global \nInventory: (.+)$")
+SOURCE_PATTERN = re.compile(r"^S(\d+)$")
+
+MATERIAL_COLUMNS: List[ColumnSpec] = [
+    ("N global \nFCM inventories where included", "Usage count", "int"),
+]
+
+SOURCE_COLUMNS: List[ColumnSpec] = [
+    ("N sources \nthat mention this chemical", "Ref count", "int"),
+]
+
+
+def _yes_no(series: pd.Series) -> pd.Series:
+    return series.str.startswith(YES)
+
+
+def _listed(series: pd.Series) -> pd.Series:
+    return series.where(series != NOT_LISTED)
+
+
+def _tonnage_bounds(series: pd.Series) -> pd.DataFrame:
+    # Tonnage bands repeat a lot, so parse each distinct string only once.
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(uniques, dtype=object)
+
+    bounds = uniques.str.extractall(TONNAGE_PATTERN).astype(float)
+    bounds[1] = bounds[1].fillna(bounds[0])
+    bounds = bounds.groupby(level=0).max().reindex(uniques.index, fill_value=0.0).to_numpy()
+
+    values = bounds[codes] if len(bounds) else np.zeros((len(series), 2))
+    values[codes == -1] = 0.0
+    return pd.DataFrame(values, index=series.index)
+
+
+def _max_tonnage(series: pd.Series) -> pd.Series:
+    return _tonnage_bounds(series)[1]
+
+
+def _min_tonnage(series: pd.Series) -> pd.Series:
+    return _tonnage_bounds(series)[0]
+
+
+def _has_fc(series: pd.Series) -> pd.Series:
+    return ~series.str.endswith(NO, na=True) & (series.str.count(";") >= 2)
+
+
+def _contains_food(series: pd.Series) -> pd.Series:
+    return series.str.contains("food", case=False)
+
+
+def _food_contact(sin_groups: pd.Series, cppdb: pd.Series) -> pd.Series:
+    return _contains_food(sin_groups).fillna(False).astype(bool) | _has_fc(cppdb)
+
+
+TRANSFORMS: Dict[str, Callable[..., pd.Series]] = {
+    "copy": lambda series: series,
+    "valid": lambda series: series.str.startswith("valid"),
+    "yes_no": _yes_no,
+    "numeric": lambda series: pd.to_numeric(series, errors="coerce"),
+    "listed": _listed,
+    "max_tonnage": _max_tonnage,
+    "min_tonnage": _min_tonnage,
+    "has_fc": _has_fc,
+    "contains_food": _contains_food,
+    "food_contact": _food_contact,
+    "int": lambda series: series.astype(int),
+    "flag": lambda series: series != 0,
+}
+
+
+def spec_sources(spec: List[ColumnSpec]) -> List[str]:
+    sources = []
+    for source, _, _ in spec:
+        for name in (source,) if isinstance(source, str) else source:
+            if name not in sources:
+                sources.append(name)
+    return sources
+
+
+def pattern_spec(columns: Iterable[str], pattern: re.Pattern, target_group: int = 0) -> List[ColumnSpec]:
+    return [(name, match.group(target_group), "flag") for name in columns if (match := pattern.match(name))]
+
+
+def apply_spec(df: pd.DataFrame, spec: List[ColumnSpec]) -> Dict[str, pd.Series]:
+    cleaned = {}
+    for source, target, kind in spec:
+        sources = (source,) if isinstance(source, str) else source
+        cleaned[target] = TRANSFORMS[kind](*(df[name] for name in sources))
+    return cleaned
+
+
+# Copies and "not listed" masks take less time than pickling their text
+# columns back from a worker, so they always run in the parent.
+LOCAL_KINDS = {"copy", "listed"}
+
+_shared_frame = None
+
+
+def _init_worker(df: pd.DataFrame) -> None:
+    # With the fork start method the frame is inherited, not pickled.
+    global _shared_frame
+    _shared_frame = df
+
+
+def _apply_shared_spec(spec: List[ColumnSpec]) -> Dict[str, pd.Series]:
+    return apply_spec(_shared_frame, spec)
+
+
+def split_spec(spec: List[ColumnSpec], parts: int) -> List[List[ColumnSpec]]:
+    size = max(1, -(-len(spec) // max(1, parts)))
+    return [spec[i:i + size] for i in range(0, len(spec), size)]
+
+
+def clean_frame(df: pd.DataFrame, specs: List[List[ColumnSpec]], jobs: int = 1) -> pd.DataFrame:
+    if jobs <= 1:
+        results = [apply_spec(df, spec) for spec in specs]
+    else:
+        local = [[column for column in spec if column[2] in LOCAL_KINDS] for spec in specs]
+        tasks = [part for spec in specs for part in split_spec([column for column in spec if column[2] not in LOCAL_KINDS], jobs)]
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(df,)) as executor:
+            futures = executor.map(_apply_shared_spec, tasks)
+            # The cheap columns are done here while the workers run.
+            results = [apply_spec(df, spec) for spec in local] + list(futures)
+
+    cleaned = {}
+    for result in results:
+        cleaned.update(result)
+    return pd.DataFrame({target: cleaned[target] for spec in specs for _, target, _ in spec}, index=df.index)
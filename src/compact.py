@@ -0,0 +1,71 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Text columns with at most this share of distinct values become categoricals.
+CATEGORY_RATIO = 0.5
+
+
+def _compact_float(series: pd.Series) -> pd.Series:
+    values = series.to_numpy()
+    present = values[~np.isnan(values)]
+
+    # Scores, tonnage bounds and counts are whole numbers stored as float
+    # because of NaN, they fit a nullable integer of the smallest size.
+    if np.array_equal(present, np.round(present)):
+        unsigned = not len(present) or present.min() >= 0
+        downcast = pd.to_numeric(pd.Series(present), downcast="unsigned" if unsigned else "integer")
+        if pd.api.types.is_integer_dtype(downcast):
+            return series.astype(f"{'U' if pd.api.types.is_unsigned_integer_dtype(downcast) else ''}Int{downcast.dtype.itemsize * 8}")
+
+    # Other floats only become float32 when no value changes.
+    narrow = values.astype(np.float32)
+    if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+        return pd.Series(narrow, index=series.index, name=series.name)
+    return series
+
+
+def compact_series(series: pd.Series, category_ratio: float = CATEGORY_RATIO) -> pd.Series:
+    if pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+
+    if pd.api.types.is_float_dtype(series):
+        return _compact_float(series)
+
+    if pd.api.types.is_integer_dtype(series):
+        unsigned = series.empty or series.min() >= 0
+        return pd.to_numeric(series, downcast="unsigned" if unsigned else "integer")
+
+    if series.dtype == object:
+        # Flags read back with missing values are objects of True/False/NaN.
+        if pd.api.types.infer_dtype(series, skipna=True) == "boolean":
+            return series.astype("boolean")
+        if series.nunique(dropna=True) <= category_ratio * max(len(series), 1):
+            return series.astype("category")
+
+    return series
+
+
+def compact_frame(df: pd.DataFrame, category_ratio: float = CATEGORY_RATIO) -> pd.DataFrame:
+    """Returns df with categoricals for repeated text, nullable booleans for
+    flags with missing values and the smallest lossless numeric types."""
+    return pd.DataFrame({column: compact_series(df[column], category_ratio) for column in df.columns}, index=df.index)
+
+
+def memory_report(df: pd.DataFrame, compact: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    compact = compact_frame(df) if compact is None else compact
+    before = df.memory_usage(deep=True, index=False)
+    after = compact.memory_usage(deep=True, index=False)
+
+    report = pd.DataFrame({
+        "column": df.columns,
+        "dtype": df.dtypes.astype(str).to_numpy(),
+        "compact_dtype": compact.dtypes.astype(str).to_numpy(),
+        "bytes": before.to_numpy(),
+        "compact_bytes": after.to_numpy(),
+    })
+    total = pd.DataFrame([{"column": "TOTAL", "dtype": "", "compact_dtype": "", "bytes": before.sum(), "compact_bytes": after.sum()}])
+    report = pd.concat([report.sort_values("bytes", ascending=False, kind="stable"), total], ignore_index=True)
+    report["ratio"] = (report["compact_bytes"] / report["bytes"]).round(3)
+    return report
@@ -0,0 +1,159 @@
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.stats import kendalltau, rankdata
+
+from src.hashing import file_checksum, frame_checksum, text_checksum
+from src.profiling import cache
+
+METHODS = ("pearson", "kendall", "spearman")
+# A variance below this share of the column's sum of squares is rounding
+# residue of a column that is constant over the rows a pair shares.
+ZERO_SPREAD = 1e-12
+
+
+def numeric_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return df.select_dtypes(exclude="object")
+
+
+def _pearson_matrix(x: np.ndarray) -> np.ndarray:
+    valid = ~np.isnan(x)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Centering first keeps the sums small, so the one-pass formulas stay accurate.
+        means = np.where(valid, x, 0.0).sum(axis=0) / valid.sum(axis=0)
+        centered = np.where(valid, x - means, 0.0)
+
+        if valid.all():
+            cov = centered.T @ centered
+            var = np.diag(cov).copy()
+            var[var <= ZERO_SPREAD * (x * x).sum(axis=0)] = np.nan
+            std = np.sqrt(var)
+            corr = cov / np.outer(std, std)
+        else:
+            # Pairwise-complete sums, like DataFrame.corr: entry (i, j) only
+            # uses rows where both columns are present.
+            weights = valid.astype(np.float64)
+            counts = weights.T @ weights
+            sums = centered.T @ weights
+            squares = (centered * centered).T @ weights
+            products = centered.T @ centered
+
+            cov = products - sums * sums.T / counts
+            var_x = squares - sums * sums / counts
+            var_x[var_x <= ZERO_SPREAD * squares] = np.nan
+            var_y = var_x.T
+            corr = cov / np.sqrt(var_x * var_y)
+            corr[counts < 1] = np.nan
+
+    return np.clip(corr, -1.0, 1.0)
+
+
+def pearson(df: pd.DataFrame) -> pd.DataFrame:
+    x = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    return pd.DataFrame(_pearson_matrix(x), index=df.columns, columns=df.columns)
+
+
+def _spearman_pair(a: np.ndarray, b: np.ndarray) -> float:
+    valid = ~(np.isnan(a) | np.isnan(b))
+    if valid.sum() < 2:
+        return np.nan
+    return _pearson_matrix(np.column_stack([rankdata(a[valid]), rankdata(b[valid])]))[0, 1]
+
+
+def spearman(df: pd.DataFrame) -> pd.DataFrame:
+    x = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    missing = np.isnan(x)
+    corr = _pearson_matrix(rankdata(x, axis=0))
+
+    # Ranks depend on which rows a pair shares, so every column with gaps
+    # is re-ranked together with the complete columns on its own rows.
+    gaps = np.flatnonzero(missing.any(axis=0))
+    complete = np.flatnonzero(~missing.any(axis=0))
+    for i in gaps:
+        rows = ~missing[:, i]
+        ranks = rankdata(x[rows][:, np.r_[i, complete]], axis=0)
+        values = _pearson_matrix(ranks)[0, 1:] if rows.sum() >= 2 else np.nan
+        corr[i, complete] = corr[complete, i] = values
+        for j in gaps:
+            corr[i, j] = corr[j, i] = _spearman_pair(x[:, i], x[:, j])
+
+    return pd.DataFrame(corr, index=df.columns, columns=df.columns)
+
+
+def _kendall_block(x: np.ndarray, pairs: List[tuple]) -> List[float]:
+    results = []
+    for i, j in pairs:
+        valid = ~(np.isnan(x[:, i]) | np.isnan(x[:, j]))
+        results.append(kendalltau(x[valid, i], x[valid, j])[0] if valid.any() else np.nan)
+    return results
+
+
+def kendall(df: pd.DataFrame, jobs: int = 1) -> pd.DataFrame:
+    x = df.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    # Kendall's tau-b of two binary columns equals their phi coefficient,
+    # so those pairs come straight from the Pearson matrix product.
+    corr = _pearson_matrix(x)
+    binary = np.array([len(np.unique(column[~np.isnan(column)])) <= 2 for column in x.T], dtype=bool)
+    pairs = [(i, j) for i in range(x.shape[1]) for j in range(i + 1, x.shape[1]) if not (binary[i] and binary[j])]
+
+    counts = (~np.isnan(x)).astype(np.float64)
+    counts = counts.T @ counts
+    np.fill_diagonal(corr, np.where(np.diag(counts) >= 1, 1.0, np.nan))
+
+    if pairs:
+        blocks = [pairs[i::max(1, jobs)] for i in range(max(1, jobs))]
+        results = Parallel(n_jobs=jobs)(delayed(_kendall_block)(x, block) for block in blocks)
+        for block, values in zip(blocks, results):
+            for (i, j), value in zip(block, values):
+                corr[i, j] = corr[j, i] = value
+
+    return pd.DataFrame(corr, index=df.columns, columns=df.columns)
+
+
+def correlation_matrix(df: pd.DataFrame, method: str = "pearson", jobs: int = 1) -> pd.DataFrame:
+    if method == "pearson":
+        return pearson(df)
+    if method == "spearman":
+        return spearman(df)
+    if method == "kendall":
+        return kendall(df, jobs)
+    raise ValueError(f"Correlation method should be one of these values: {METHODS}.")
+
+
+def cached_correlation_matrix(df: pd.DataFrame, method: str, cache_folder: str, jobs: int = 1) -> pd.DataFrame:
+    # Keyed by this module's source too, so fixes do not serve old matrices.
+    key = text_checksum(frame_checksum(df), file_checksum(__file__))
+    path = os.path.join(cache_folder, f"{method}_{key[:16]}.parquet")
+    cache("correlations", os.path.exists(path))
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    matrix = correlation_matrix(df, method, jobs)
+    os.makedirs(cache_folder, exist_ok=True)
+    matrix.to_parquet(path)
+    return matrix
+
+
+def top_pairs(matrix: pd.DataFrame, k: Optional[int] = None, threshold: Optional[float] = None) -> pd.DataFrame:
+    rows, cols = np.triu_indices(len(matrix), k=1)
+    values = matrix.to_numpy()[rows, cols]
+
+    pairs = pd.DataFrame({
+        "column_a": matrix.index[rows],
+        "column_b": matrix.columns[cols],
+        "correlation": values,
+    }).dropna(subset=["correlation"])
+
+    if threshold is not None:
+        pairs = pairs[pairs["correlation"].abs() >= threshold]
+
+    pairs = pairs.reindex(pairs["correlation"].abs().sort_values(ascending=False, kind="stable").index)
+    if k is not None:
+        pairs = pairs.head(k)
+
+    return pairs.reset_index(drop=True)
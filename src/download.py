@@ -0,0 +1,166 @@
+import json
+import os
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.hashing import CHUNK_SIZE, file_checksum
+from src.profiling import cache, count, event
+
+
+class DownloadError(Exception):
+    pass
+
+
+def make_session(retries: int = 5, backoff: float = 1.0) -> requests.Session:
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+    )
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
+
+def get_record_checksum(session: requests.Session, record_url: str, file_url: str, timeout: float = 30) -> Optional[str]:
+    resp = session.get(record_url, timeout=timeout)
+    resp.raise_for_status()
+
+    file_name = file_url.rstrip("/").split("/")[-1]
+    for entry in resp.json().get("files", []):
+        links = entry.get("links", {})
+        if entry.get("key") == file_name or file_url in links.values():
+            return entry.get("checksum")
+
+    return None
+
+
+def get_record_versions(session: requests.Session, record_url: str, timeout: float = 30) -> List[dict]:
+    """Returns every published version of a Zenodo record, following the
+    record's versions link page by page."""
+    resp = session.get(record_url, timeout=timeout)
+    resp.raise_for_status()
+    record = resp.json()
+
+    url = record.get("links", {}).get("versions")
+    if not url:
+        return [record]
+
+    versions = []
+    params = {"size": 100, "sort": "version"}
+    while url:
+        resp = session.get(url, params=params, timeout=timeout)
+        resp.raise_for_status()
+        page = resp.json()
+        versions += page.get("hits", {}).get("hits", [])
+        # The next link already carries the query.
+        url, params = page.get("links", {}).get("next"), None
+    return versions
+
+
+def _read_meta(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_meta(path: str, meta: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _verify(path: str, checksum: str) -> None:
+    algorithm, _, expected = checksum.partition(":")
+    if not expected:
+        algorithm, expected = "md5", algorithm
+
+    actual = file_checksum(path, algorithm)
+    if actual != expected:
+        raise DownloadError(f"Checksum mismatch for {path}: expected {algorithm}:{expected}, got {algorithm}:{actual}")
+
+
+def download_file(
+    url: str,
+    path: str,
+    checksum: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    chunk_size: int = CHUNK_SIZE,
+    timeout: float = 60,
+) -> bool:
+    """Streams url into path, resuming a previous partial download and
+    skipping the transfer when the server reports the file unchanged.
+
+    Returns True when a new file was written, False when the local copy
+    is still current.
+    """
+    session = session or make_session()
+    part_path = f"{path}.part"
+    meta_path = f"{path}.meta.json"
+    meta = _read_meta(meta_path)
+
+    headers = {}
+    if os.path.exists(path) and meta.get("url") == url:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    part_meta = meta.get("partial", {})
+    if offset and part_meta.get("url") == url:
+        headers["Range"] = f"bytes={offset}-"
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        if resp.status_code == 304:
+            cache("download", hit=True)
+            event("download.not_modified", path=path)
+            return False
+
+        if resp.status_code == 416:
+            # The partial file is at least as large as the remote one, start over.
+            os.remove(part_path)
+            meta.pop("partial", None)
+            _write_meta(meta_path, meta)
+            return download_file(url, path, checksum, session, chunk_size, timeout)
+
+        if resp.status_code not in (200, 206):
+            raise DownloadError(f"Unexpected status {resp.status_code} while downloading {url}")
+
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        mode = "ab" if resp.status_code == 206 else "wb"
+
+        meta["partial"] = {"url": url, "etag": etag, "last_modified": last_modified}
+        _write_meta(meta_path, meta)
+
+        cache("download", hit=False)
+        event("download.write", path=path, resume_offset=offset if mode == "ab" else 0)
+        with open(part_path, mode) as part_file:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                part_file.write(chunk)
+                count("download.bytes", len(chunk))
+
+    if checksum:
+        try:
+            _verify(part_path, checksum)
+        except DownloadError:
+            os.remove(part_path)
+            meta.pop("partial", None)
+            _write_meta(meta_path, meta)
+            raise
+
+    os.replace(part_path, path)
+    _write_meta(meta_path, {"url": url, "etag": etag, "last_modified": last_modified, "checksum": checksum})
+    return True
@@ -1,48 +1,62 @@
+from __future__ import annotations
+
 import logging
 import os
 import re
 import tomllib
-import warnings
-
-import joblib
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, roc_curve, auc
-from sklearn.linear_model import LogisticRegression
+from itertools import groupby
+from operator import itemgetter
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+
 import numpy as np
 import pandas as pd
-import requests
-
-MATERIALS = [
-    "Plastics",
-    "Coatings",
-    "Rubber",
-    "Silicones",
-    "Ion-Exchange Resins",
-    "Paper/Board",
-    "Cellophane",
-    "Textiles",
-    "Cork and Wood",
-    "Adhesives",
-    "Colorants",
-    "Printing Inks",
-    "Wax",
-    "Inorganics",
-    "A&I Materials",
-    "Other Uses",
-]
+
+from src.bitmap import BitmapIndex, flag_columns
+from src.cleaning import (
+    LISTS_COLUMNS,
+    MATERIALS,
+    MATERIAL_COLUMNS,
+    MATERIAL_PATTERN,
+    MOST_VALUABLE_COLUMNS,
+    NO,
+    NOT_LISTED,
+    SOURCE_COLUMNS,
+    SOURCE_PATTERN,
+    YES,
+    ColumnSpec,
+    clean_frame,
+    pattern_spec,
+    spec_sources,
+)
+from src.hashing import file_checksum
+from src.profiling import cache, stage
+
+# sklearn, matplotlib, scipy, requests and openpyxl are imported inside the
+# methods that use them, so the CLI only pays for what a command needs.
+if TYPE_CHECKING:
+    from sklearn.linear_model import LogisticRegression
+
+    from src.lookup import SubstanceIndex
+    from src.releases import Release, ReleaseStore
+
+REGRESSION_COLUMNS = MATERIALS + ["food_contact"]
+MODEL_FILE = "model.joblib"
+SWEEP_FILE = "model_sweep.csv"
 
 class FFC_DB:
-    YES = "yes"
-    NO = "no"
-    NOT_LISTED = "not listed"
+    YES = YES
+    NO = NO
+    NOT_LISTED = NOT_LISTED
+
+    RAW_COLUMNS = spec_sources(MOST_VALUABLE_COLUMNS + MATERIAL_COLUMNS + SOURCE_COLUMNS + LISTS_COLUMNS)
+    RAW_COLUMN_PATTERN = re.compile(f"{SOURCE_PATTERN.pattern}|{MATERIAL_PATTERN.pattern}")
+    RAW_SELECTION_KEY = "\n".join(RAW_COLUMNS + [RAW_COLUMN_PATTERN.pattern])
 
     def __init__(self, config: str = "constants.toml") -> None:
+        self.config_path = config
         with open(config, "rb") as f:
             self.config = tomllib.load(f)
+        self._workbook_checksum = None
         
         if not os.path.exists(self.config.get("data_folder")):
             os.mkdir(self.config.get("data_folder"))
@@ -55,151 +69,320 @@ class FFC_DB:
     def is_cleaned(self) -> bool:
         return os.path.exists(self.config.get("cleaned_file"))
 
-    def download_xlsx(self) -> None:
-        headers = {"Content-Type": "application/json"}
-        resp = requests.get(self.config.get("api_xl_url"), headers=headers)
+    @property
+    def figure_cache_folder(self) -> str:
+        return os.path.join(self.config.get("data_folder"), "figures")
 
-        if not resp.status_code == 200:
-            return
+    @property
+    def is_chunked(self) -> bool:
+        return bool(self.config.get("clean_chunk_rows") or self.config.get("inventory_files"))
+
+    @property
+    def chunk_rows(self) -> int:
+        from src.chunked import CHUNK_ROWS
+
+        return self.config.get("clean_chunk_rows") or CHUNK_ROWS
+
+    @property
+    def raw_folder(self) -> str:
+        return os.path.join(self.config.get("data_folder"), "raw")
 
-        logging.info(f"Writing data to file {self.config.get('ffc_db_file')}")
-        with open(self.config.get("ffc_db_file"), "wb") as xl_file:
-            xl_file.write(resp.content)
+    @property
+    def features_path(self) -> str:
+        return os.path.join(self.config.get("data_folder"), "features.parquet")
+
+    @property
+    def sqlite_path(self) -> str:
+        return os.path.join(self.config.get("data_folder"), "FFCdb.sqlite")
 
-    def clean_data(self) -> None:
+    @property
+    def releases_folder(self) -> str:
+        return os.path.join(self.config.get("data_folder"), "releases")
+
+    def workbook_checksum(self) -> str:
+        # Pipeline runs ask for the snapshot path several times, the workbook
+        # is only hashed again when its size or mtime change.
+        path = self.config.get("ffc_db_file")
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if self._workbook_checksum is None or self._workbook_checksum[0] != key:
+            self._workbook_checksum = (key, file_checksum(path, "sha256"))
+        return self._workbook_checksum[1]
+
+    def raw_snapshot_path(self) -> str:
+        from src.ingest import snapshot_path
+
+        return snapshot_path(self.raw_folder, self.workbook_checksum(), self.config.get("data_sheet_name"), self.RAW_SELECTION_KEY)
+
+    def correlations_path(self, method: str, pairs: bool = False) -> str:
+        return f"correlations_{method}_pairs.csv" if pairs else f"correlations_{method}.csv"
+
+    def download_xlsx(self) -> bool:
+        import requests
+
+        from src.download import download_file, get_record_checksum, make_session
+
+        session = make_session()
+
+        checksum = None
+        if self.config.get("api_record_url"):
+            try:
+                checksum = get_record_checksum(session, self.config.get("api_record_url"), self.config.get("api_xl_url"))
+            except (requests.RequestException, ValueError) as e:
+                logging.warning(f"Could not fetch checksum from {self.config.get('api_record_url')}: {e}")
+
+        with stage("download", url=self.config.get("api_xl_url")) as record:
+            record["changed"] = download_file(self.config.get("api_xl_url"), self.config.get("ffc_db_file"), checksum=checksum, session=session)
+        return record["changed"]
+
+    def clean_data(self, jobs: int = 1) -> None:
         if not self.is_downloaded:
             return
+
+        if self.is_chunked:
+            self.clean_data_chunked(jobs=jobs)
+            return
         
-        warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+        with stage("clean", jobs=jobs) as record:
+            df = self.read_raw_data()
+            specs = self._cleaning_specs(df.columns)
+            with stage("transform", jobs=jobs):
+                cleaned_df = clean_frame(df, specs, jobs)
+
+            with stage("write_clean", path=self.config.get("cleaned_file")):
+                self._write_clean_data(cleaned_df, self.config.get("cleaned_file"), specs)
+            record.update(rows=len(cleaned_df), columns=cleaned_df.shape[1])
+
+    def _inventory_chunks(self, inventories: Optional[List[str]] = None, chunk_rows: Optional[int] = None) -> Tuple[List[str], List[str], Iterator[Tuple[str, pd.DataFrame]]]:
+        """Returns the raw sheet and extra inventory paths, the union of their
+        raw columns and their row chunks tagged with the path, in that order."""
+        from src.ingest import iter_sheet_chunks, read_sheet_header
+
+        sheet_name = self.config.get("data_sheet_name")
+        chunk_rows = chunk_rows or self.chunk_rows
+        paths = [self.config.get("ffc_db_file")] + list(inventories if inventories is not None else self.config.get("inventory_files", []))
+
+        # Every inventory gets the union of the material and source columns.
+        columns = list(dict.fromkeys(name for path in paths for name in read_sheet_header(path, sheet_name) if self._is_raw_column(name)))
+        chunks = ((path, chunk) for path in paths for chunk in iter_sheet_chunks(path, sheet_name, self._is_raw_column, chunk_rows))
+        return paths, columns, chunks
+
+    def clean_data_chunked(self, inventories: Optional[List[str]] = None, chunk_rows: Optional[int] = None, jobs: int = 1) -> None:
+        """Streams the raw sheet and any extra inventories in row chunks into
+        one cleaned file, so memory depends on chunk size, not data size."""
+        from src.chunked import INVENTORY_COLUMN, ChunkWriter, clean_chunks, spec_schema
+
+        paths, columns, chunks = self._inventory_chunks(inventories, chunk_rows)
+        specs = self._cleaning_specs(columns)
+        merge = len(paths) > 1
+
+        with stage("clean_chunked", inventories=len(paths), chunk_rows=chunk_rows or self.chunk_rows, jobs=jobs) as record:
+            with ChunkWriter(self.config.get("cleaned_file"), spec_schema(specs, merge)) as writer:
+                for path, path_chunks in groupby(chunks, key=itemgetter(0)):
+                    for cleaned in clean_chunks((chunk for _, chunk in path_chunks), specs, jobs):
+                        if merge:
+                            cleaned.insert(0, INVENTORY_COLUMN, os.path.basename(path))
+                        writer.write(cleaned)
+            record.update(rows=writer.rows, columns=len(writer.schema))
+
+    def _is_raw_column(self, name: str) -> bool:
+        return name in self.RAW_COLUMNS or self.RAW_COLUMN_PATTERN.match(name) is not None
+
+    def export_sqlite(self, path: Optional[str] = None) -> int:
+        """Exports the cleaned data with the "+ why" detail of the raw sheet
+        parsed into long tables to a SQLite database."""
+        from src.relational import export_sqlite
+
+        clean = self.get_clean_data()
+        if self.is_chunked:
+            _, columns, tagged = self._inventory_chunks()
+            raw_chunks = (chunk for _, chunk in tagged)
+        else:
+            raw = self.read_raw_data()
+            columns, raw_chunks = list(raw.columns), [raw]
+
+        def chunks():
+            offset = 0
+            for raw_chunk in raw_chunks:
+                yield clean.iloc[offset:offset + len(raw_chunk)], raw_chunk
+                offset += len(raw_chunk)
+
+        materials = [target for _, target, _ in pattern_spec(columns, MATERIAL_PATTERN, 1)]
+        sources = [target for _, target, _ in pattern_spec(columns, SOURCE_PATTERN)]
+        return export_sqlite(path or self.sqlite_path, chunks(), materials, sources)
+
+    def get_release_store(self) -> ReleaseStore:
+        from src.releases import ReleaseStore
+
+        return ReleaseStore(self.releases_folder)
+
+    def discover_releases(self) -> List[Release]:
+        from src.download import get_record_versions, make_session
+        from src.releases import discover_releases
+
+        return discover_releases(get_record_versions(make_session(), self.config.get("api_record_url")))
+
+    def add_release(self, path: str, name: str, meta: Optional[dict] = None, jobs: int = 1) -> dict:
+        from src.ingest import iter_sheet_chunks, read_sheet_header
+
+        sheet_name = self.config.get("data_sheet_name")
+        columns = [column for column in read_sheet_header(path, sheet_name) if self._is_raw_column(column)]
+        chunks = iter_sheet_chunks(path, sheet_name, self._is_raw_column, self.chunk_rows)
+        return self.get_release_store().add(name, chunks, columns, self._cleaning_specs(columns), {"file": path, **(meta or {})}, jobs)
+
+    def update_releases(self, names: Optional[List[str]] = None, jobs: int = 1) -> List[str]:
+        """Downloads the releases of api_record_url that are new or changed
+        and stores them, returns the names of the releases that were added."""
+        from src.download import download_file, make_session
+        from src.ingest import read_sheet_header
+        from src.releases import file_name
+
+        store = self.get_release_store()
+        session = make_session()
+        raw_folder = os.path.join(self.releases_folder, "raw")
+        os.makedirs(raw_folder, exist_ok=True)
+
+        added = []
+        for release in self.discover_releases():
+            if names and release.name not in names:
+                continue
+
+            path = os.path.join(raw_folder, f"{file_name(release.name)}_{release.file_name}")
+            with stage("download", url=release.url) as record:
+                record["changed"] = download_file(release.url, path, checksum=release.checksum, session=session)
+
+            # Cleaning code changes also restore a release, reusing what still matches.
+            columns = [column for column in read_sheet_header(path, self.config.get("data_sheet_name")) if self._is_raw_column(column)]
+            if record["changed"] or not store.is_current(release.name, columns):
+                self.add_release(path, release.name, release._asdict(), jobs)
+                added.append(release.name)
+        return added
+
+    def diff_releases(self, old: str, new: str, detail: bool = False) -> pd.DataFrame:
+        return self.get_release_store().diff(old, new, detail)
+
+    def read_raw_data(self, force: bool = False) -> pd.DataFrame:
+        from src.ingest import load_raw_frame
+
+        with stage("read_raw") as record:
+            df = load_raw_frame(
+                self.config.get("ffc_db_file"),
+                self.config.get("data_sheet_name"),
+                self._is_raw_column,
+                self.raw_snapshot_path(),
+                force,
+            )
+            record.update(rows=len(df), columns=df.shape[1])
+        return df
 
-        df = pd.read_excel(self.config.get("ffc_db_file"), engine="openpyxl", sheet_name=self.config.get("data_sheet_name") )
+    def _cleaning_specs(self, columns: Iterable[str]) -> List[List[ColumnSpec]]:
+        return [
+            MOST_VALUABLE_COLUMNS,
+            pattern_spec(columns, MATERIAL_PATTERN, 1) + MATERIAL_COLUMNS,
+            pattern_spec(columns, SOURCE_PATTERN) + SOURCE_COLUMNS,
+            LISTS_COLUMNS,
+        ]
+
+    def _write_clean_data(self, df: pd.DataFrame, path: str, specs: List[List[ColumnSpec]]) -> None:
+        from src.chunked import ChunkWriter, spec_schema
+
+        # The same fixed schema as the chunked store, instead of inferred types.
+        with ChunkWriter(path, spec_schema(specs)) as writer:
+            writer.write(df)
+
+    def get_clean_data(self, columns: Optional[List[str]] = None, compact: bool = False) -> pd.DataFrame:
+        """With compact repeated text becomes categorical, flags with missing
+        values nullable booleans and numbers the smallest lossless type."""
+        path = self.config.get("cleaned_file")
+        with stage("get_clean_data") as record:
+            if path.endswith(".csv"):
+                df = pd.read_csv(path, usecols=columns)
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pq.read_table(path, columns=columns)
+                df = table.to_pandas()
+                # Flags with missing values would come back as objects and
+                # drop out of every numeric selection.
+                nullable = [field.name for field in table.schema if pa.types.is_boolean(field.type) and table.column(field.name).null_count]
+                df[nullable] = df[nullable].astype("boolean")
+            if compact:
+                from src.compact import compact_frame
+
+                df = compact_frame(df)
+            record.update(rows=len(df), columns=df.shape[1], compact=compact)
+        return df
 
-        cleaned_df = pd.DataFrame()
+    def memory_report(self) -> pd.DataFrame:
+        from src.compact import memory_report
 
-        self._clean_most_valuable_columns(df, cleaned_df)
-        
-        self._clean_sources(df, cleaned_df)
-        self._clean_lists_columns(df, cleaned_df)
-
-        cleaned_df.to_csv(self.config.get("cleaned_file"))
-
-    def _clean_most_valuable_columns(self, df: pd.DataFrame, new_df: pd.DataFrame) -> None:
-        new_df["CAS validity"] = df["CAS \nvalidity"].str.startswith("valid")
-        new_df["CAS/CFSAN number"] = df["CAS \nnumber or CFSAN id"]
-        new_df["Name"] = df["Name"]
-        new_df["Synonyms"] = df["Synonyms, \nas used by other sources"]
-        new_df["Hazardous auth"] = self._yes_no_column(df["Priority hazardous substance prioritized based on selected authoritative sources? + why"])
-        new_df["Potential concern non-auth"] = self._yes_no_column(df["Substance of potential concern identified based on selected non-authoritative sources? + why"])
-        new_df["ECHA: HH"] = pd.to_numeric(df["ECHA \nC&L: \nSUM HH"], errors="coerce")
-        new_df["ECHA: ENVH"] = pd.to_numeric(df["ECHA \nC&L: SUM ENVH"], errors="coerce")
-        new_df["ECHA: Signal Word"] = df["ECHA \nC&L: Signal Word"].where(df["ECHA \nC&L: Signal Word"] != self.NOT_LISTED)
-        new_df["ECHA: Classification"] = df["ECHA \nC&L: \nClassification"].where(df["ECHA \nC&L: \nClassification"] != self.NOT_LISTED)
-        new_df["GHS-J: HH"] = pd.to_numeric(df["GHS-J: \nSUM HH"], errors="coerce")
-        new_df["GHS-J: ENVH"] = pd.to_numeric(df["GHS-J: \nSUM ENVH"], errors="coerce")
-        new_df["GHS-J: Signal Word"] = df["GHS-J: \nSignal Word"].where(df["GHS-J: \nSignal Word"] != self.NOT_LISTED)
-        new_df["GHS-J: Classification"] = df["GHS-J: \nClassification"].where(df["GHS-J: \nClassification"] != self.NOT_LISTED)
-
-        new_df["GHS-aligned classifications"] = df["Danish \nEPA's predicted GHS-aligned classifications for HH or ENVH"].where(df["Danish \nEPA's predicted GHS-aligned classifications for HH or ENVH"] != self.NOT_LISTED)
-        new_df["GHS-aligned HH priority"] = df["predicted priority HH: potential CMR substance based on the Danish EPA's predicted GHS-aligned classifications? + which classifications decisive"].where(df["predicted priority HH: potential CMR substance based on the Danish EPA's predicted GHS-aligned classifications? + which classifications decisive"] != self.NOT_LISTED)
-        new_df["GHS-aligned ENVH priority"] = df["predicted priority ENVH: Class 1 Aq. Chronic with or without Aq. Acute 1 toxicant based on the Danish EPA's predicted GHS-aligned classifications? + which classifications decisive"].where(df["predicted priority ENVH: Class 1 Aq. Chronic with or without Aq. Acute 1 toxicant based on the Danish EPA's predicted GHS-aligned classifications? + which classifications decisive"] != self.NOT_LISTED)
-        new_df["max_tonnage"] = [self._get_max_tonnage(val) for val in df["Registered under REACH? + tonnage"]]
-        new_df["min_tonnage"] = [self._get_min_tonnage(val) for val in df["Registered under REACH? + tonnage"]]
-        new_df["CPPdb food contact"] = [self._has_fc(x) for x in df["included in the CPPdb?\n + List A or B status and if considered fc (assessed for ListA only)"]]
-        new_df["SIN food contact"] = df["SIN \nList's use groups"].str.contains("food", case=False)
-        new_df["food_contact"] = new_df["SIN food contact"] or new_df["CPPdb food contact"]
-        
-        new_df["SIN groups"] = df["SIN \nList's use groups"]
-        new_df["PMT/vPvM UBA"] = df["PMT/vPvM classification by UBA 2019 report + Assessment quality"]
-        self._clean_material_info(df, new_df)
-
-
-
-    def _clean_lists_columns(self, df: pd.DataFrame, new_df: pd.DataFrame):
-        new_df["EDC REACH"] = self._yes_no_column(df["EDC,  REACH classification"])
-        new_df["EDC EU"] = self._yes_no_column(df["Included on the EU Endocrine Disruptor Lists? + List type"])
-        new_df["EDC ECHA"] = self._yes_no_column(df["Included on the ECHA's Endocrine disruptor assessment list? + Status + Outcome + Follow-up + Authority"])
-        new_df["EDC UNEP"] = self._yes_no_column(df["EDC included in \n2018 UNEP report?"])
-        new_df["EDC TEDX"] = self._yes_no_column(df["EDC \non TEDX list?"])
-        new_df["EDC REACH/Biociedes requlations"] = self._yes_no_column(df["EDC recognized in the EU under REACH or Biocides regulation"])
-        new_df["PBT/vPvB/POP EU US"] = self._yes_no_column(df["PBT \nor vPvB or POP? (EU, US)"])
-        new_df["PBT ECHA"] = self._yes_no_column(df["On ECHA's PBT assessment list? + Status + Outcome + Follow-up + Assessment date + Authority"])
-        new_df["SVHC REACH"] = self._yes_no_column(df["On EU \nREACH \nSVHC list (Candidate list for authorization)? + reasons for inclusion"])
-        new_df["Authorization list REACH"] = self._yes_no_column(df["On EU \nREACH \nAuthorization list, Annex XIV? + reasons for inclusion"])
-        new_df["Restriction list REACH"] = self._yes_no_column(df["On EU \nREACH Restriction list, Annex XVII? + entry number"])
-        new_df["Cal Prop65"] = self._yes_no_column(df["on Cal \nProp65 List? + indicated toxicity"])
-        new_df["CoRAP EU"] = self._yes_no_column(df["on EU CoRAP list? + Status + Initial grounds for concern + Year + Evaluating Member State"])
-        new_df["OpenFoodToxDB EFSA"] = self._yes_no_column(df["In EFSA's Open Food Tox database?"])
-        new_df["Genotoxicity OFTDB EFSA"] = df["Genotoxicity Calls from EFSA OpenFoodTox database"]
-        new_df["SCI EPA"] = self._yes_no_column(df["on EPA's \nsafer \nchemical ingredients \nlist?"])
-        new_df["Genotoxic concer by van Bossuyt"] = self._yes_no_column(df["Substances \nof genotoxic concern, prioritized by van Bossuyt et al. 2017, 2018"])
-        new_df["SIN"] = self._yes_no_column(df["on \nSIN list?\n + reasons for inclusion"])
-        new_df["ToxValDB"] = self._yes_no_column(df["In ToxVal\ndatabase? + N DataSources; N PubmedArticles; N PubchemDataSources; N CPDatCount"])
-        new_df["Registerd REACH"] = self._yes_no_column(df["Registered under REACH? + tonnage"])
-        new_df["Chemical Universe Mapping REACH"] = self._yes_no_column(df["on the REACH Chemical Universe Mapping list? + Tonnage + Registration Status + Position in the chemical universe"])
-        new_df["Plastics additives ECHA"] = self._yes_no_column(df["on ECHA's \nplastics additives list? + main function indicated by ECHA"])
-        new_df["CPPdb"] = self._yes_no_column(df["included in the CPPdb?\n + List A or B status and if considered fc (assessed for ListA only)"])
-        new_df["TSCA"] = self._yes_no_column(df["on TSCA \ninventory? + status"])
-        new_df["NZIOC"] = self._yes_no_column(df["on New \nZealand list of chemicals (NZIOC)? + conditions"])   
-
-    def _clean_material_info(self, df: pd.DataFrame, new_df: pd.DataFrame) -> None:
-        for col_name in df.columns:
-            if match := re.match(r"^Global \nInventory: (.+)$", col_name):
-                material = match.group(1)
-                new_df[material] = df[col_name] != 0
-
-        new_df["Usage count"] = df["N global \nFCM inventories where included"].astype(int)
-
-    def _clean_sources(self, df: pd.DataFrame, new_df: pd.DataFrame) -> None:
-        for col_name in df.columns:
-            if match := re.match(r"^S(\d+)$", col_name):
-                new_df[col_name] = df[col_name] != 0
-
-        new_df["Ref count"] = df["N sources \nthat mention this chemical"].astype(int)
-
-
-    def _get_max_tonnage(self, val: str) -> float:
-        result = 0.0
-        for value in val.split("; "):
-            if match := re.match(r"(\d+)\s*-\s*(\d+)", value):
-                result = max(result, float(match.group(2)))
-            
-            if match := re.match(r"(\d+)\+?", value):
-                result = max(result, float(match.group(1)))
-
-        return result
-    
-    def _get_min_tonnage(self, val: str) -> float:
-        result = 0.0
-        for value in val.split("; "):
-            if match := re.match(r"(\d+)\s*-\s*(\d+)", value):
-                result = max(result, float(match.group(1)))
-            
-            if match := re.match(r"(\d+)\+?", value):
-                result = max(result, float(match.group(1)))
-
-        return result
-
-    def _has_fc(self, val: str) -> bool:
-       if val.endswith(self.NO):
-           return False
-       
-       fc_check = val.split(';')
-       
-       if len(fc_check) < 3:
-           return False
-       
-       return True
-       
- 
-    def _yes_no_column(self, series: pd.Series) -> pd.Series:
-        return series.str.startswith(self.YES)
-
-    def get_clean_data(self) -> pd.DataFrame:
-        return pd.read_csv(self.config.get("cleaned_file"))
+        return memory_report(self.get_clean_data())
+
+    def export_clean_data(self, path: str, columns: Optional[List[str]] = None) -> None:
+        self.get_clean_data(columns).to_csv(path, index=False)
+
+    def save_features(self) -> None:
+        self.get_clean_data().select_dtypes(exclude="object").to_parquet(self.features_path, engine="pyarrow", index=False)
+
+    def get_features(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return pd.read_parquet(self.features_path, engine="pyarrow", columns=columns)
+
+    def get_flag_columns(self) -> List[str]:
+        path = self.config.get("cleaned_file")
+        if path.endswith(".csv"):
+            return flag_columns(self.get_clean_data())
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        return [field.name for field in pq.read_schema(path) if pa.types.is_boolean(field.type)]
+
+    def get_bitmap_index(self) -> BitmapIndex:
+        path = os.path.join(self.config.get("data_folder"), "bitmap_index.npz")
+        fresh = os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.config.get("cleaned_file"))
+        cache("bitmap_index", fresh)
+        if fresh:
+            return BitmapIndex.load(path)
+
+        columns = self.get_flag_columns()
+        index = BitmapIndex.from_frame(self.get_clean_data(columns), columns)
+        index.save(path)
+        return index
+
+    def get_lookup_index(self) -> SubstanceIndex:
+        from src.lookup import COLUMNS, SubstanceIndex
+
+        path = os.path.join(self.config.get("data_folder"), "lookup_index.npz")
+        cleaned_file = self.config.get("cleaned_file")
+        index = SubstanceIndex.load(path) if os.path.exists(path) else None
+        if index is not None and os.path.getmtime(path) < os.path.getmtime(cleaned_file):
+            # A cleaned file rewritten with the same content keeps its index.
+            if index.source == file_checksum(cleaned_file):
+                os.utime(path)
+            else:
+                index = None
+
+        cache("lookup_index", index is not None)
+        if index is None:
+            index = SubstanceIndex.from_frame(self.get_clean_data(COLUMNS), source=file_checksum(cleaned_file))
+            index.save(path)
+        return index
     
-    def save_correlations(self, df: pd.DataFrame = None, method: str = "pearson"):
-        correlation_matrix = df.select_dtypes(exclude='object').corr(method=method)
-        correlation_matrix.to_csv(f"correlations_{method}.csv")
+    def save_correlations(self, df: pd.DataFrame = None, method: str = "pearson", top_k: Optional[int] = None, threshold: Optional[float] = None, jobs: int = 1):
+        from src.correlation import cached_correlation_matrix, numeric_frame, top_pairs
+
+        cache_folder = os.path.join(self.config.get("data_folder"), "correlations")
+        with stage("correlations", method=method, jobs=jobs) as record:
+            numeric = numeric_frame(df)
+            record.update(rows=len(numeric), columns=numeric.shape[1])
+            correlation_matrix = cached_correlation_matrix(numeric, method, cache_folder, jobs)
+
+            if top_k is None and threshold is None:
+                correlation_matrix.to_csv(self.correlations_path(method))
+                return
+
+            top_pairs(correlation_matrix, top_k, threshold).to_csv(self.correlations_path(method, pairs=True), index=False)
 
     def prepare_data_to_logistic_regression(self, df: pd.DataFrame) -> pd.DataFrame:
         df = df.select_dtypes(exclude="object")
@@ -207,67 +390,57 @@ class FFC_DB:
         df.to_csv("temp.csv")
         return df
 
-    def run_regression(self, df: pd.DataFrame, save_model: bool = False) -> None:
+    def run_regression(self, df: pd.DataFrame, save_model: bool = False, jobs: int = 1) -> None:
+        import joblib
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.metrics import accuracy_score
+        from sklearn.model_selection import train_test_split
+
         data_to_regression = self.prepare_data_to_logistic_regression(df)
         X = data_to_regression.drop(columns=['food_contact'])
         y = data_to_regression['food_contact']
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
         
         clf = LogisticRegression(max_iter=1000)
-        clf.fit(X_train, y_train)
+        with stage("fit", rows=len(X_train), columns=X_train.shape[1]):
+            clf.fit(X_train, y_train)
 
         y_pred = clf.predict(X_test)
 
         accuracy = accuracy_score(y_test, y_pred)
         print(f"Accuracy of regression: {100 * accuracy:.2f}%")
-        self.plot_regression_results(clf, X_test, y_test, y_pred, save_model)
+        self.plot_regression_results(clf, X_test, y_test, y_pred, save_model, jobs)
 
         if save_model:
-            joblib.dump(clf, "model.joblib")
+            joblib.dump(clf, MODEL_FILE)
         
 
-    def plot_regression_results(self, clf: LogisticRegression, X_test: pd.DataFrame, y_test: pd.Series, y_pred: np.ndarray, save_model: bool = False) -> None:
+    def run_sweep(self, df: pd.DataFrame, folds: int = 5, jobs: int = 1) -> pd.DataFrame:
+        from src.sweep import run_sweep
+
+        with stage("sweep", rows=len(df), folds=folds, jobs=jobs):
+            metrics = run_sweep(df, folds=folds, jobs=jobs)
+        metrics.to_csv(SWEEP_FILE, index=False)
+        return metrics
+
+    def plot_regression_results(self, clf: LogisticRegression, X_test: pd.DataFrame, y_test: pd.Series, y_pred: np.ndarray, save_model: bool = False, jobs: int = 1) -> None:
+        from src import visualization
+
         if save_model:
-            self.plot_confiusion_matrix(y_test, y_pred, True)
-            self.plot_ROC(clf, X_test, y_test, True)
+            y_prob = clf.predict_proba(X_test)[:, 1]
+            visualization.render_figures(visualization.regression_figure_jobs(y_test, y_pred, y_prob), self.figure_cache_folder, jobs)
             return
 
         self.plot_confiusion_matrix(y_test, y_pred)
         self.plot_ROC(clf, X_test, y_test)
 
     def plot_confiusion_matrix(self, y_test: pd.Series, y_pred: np.ndarray, save_model: bool = False) -> None:
-        cm = confusion_matrix(y_test, y_pred)
-        plt.figure(figsize=(8,6))
-        sns.heatmap(cm, annot=True, fmt='g', cmap='Blues', cbar=False)
-        plt.xlabel('Predicted labels')
-        plt.ylabel('True labels')
-        plt.title('Confusion Matrix')
+        from src import visualization
 
-        if save_model:
-            plt.savefig("confiusion_matrix.png")
-            return
-        
-        plt.show(block=False)
-        plt.pause(0.2)
+        visualization.plot_confusion_matrix(pd.DataFrame({"y_true": np.asarray(y_test), "y_pred": y_pred}), save_model)
 
     def plot_ROC(self, clf: LogisticRegression, X_test: pd.DataFrame, y_test: pd.Series, save_model: bool = False):
-        y_prob = clf.predict_proba(X_test)[:, 1]
-        fpr, tpr, thresholds = roc_curve(y_test, y_prob)
-        roc_auc = auc(fpr, tpr)
-
-        plt.figure(figsize=(8,6))
-        plt.plot(fpr, tpr, color='darkorange', label=f'ROC curve (area = {roc_auc:.2f})')
-        plt.plot([0, 1], [0, 1], color='navy', linestyle='--')
-        plt.xlabel('False Positive Rate')
-        plt.ylabel('True Positive Rate')
-        plt.title('Receiver Operating Characteristic (ROC) Curve')
-        plt.legend(loc='lower right')
-        
-        if save_model:
-            plt.savefig("ROC.png")
-            return
-        
-        plt.show(block=False)
-        plt.pause(0.2)
-
+        from src import visualization
 
+        y_prob = clf.predict_proba(X_test)[:, 1]
+        visualization.plot_ROC(pd.DataFrame({"y_true": np.asarray(y_test), "y_prob": y_prob}), save_model)
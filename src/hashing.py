@@ -0,0 +1,27 @@
+import hashlib
+
+import pandas as pd
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_checksum(path: str, algorithm: str = "md5") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_checksum(*parts: str, algorithm: str = "sha256") -> str:
+    digest = hashlib.new(algorithm)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def frame_checksum(df: pd.DataFrame) -> str:
+    digest = hashlib.sha256("\n".join(map(str, df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
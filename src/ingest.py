@@ -0,0 +1,123 @@
+import glob
+import os
+from typing import Callable, Iterator, List, Tuple
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+from src.hashing import text_checksum
+from src.profiling import cache, stage
+
+SNAPSHOT_PREFIX = "raw_"
+SNAPSHOT_SUFFIX = ".pkl"
+
+
+def _convert_value(value):
+    # Mirrors pandas' openpyxl reader so the frame matches pd.read_excel.
+    if value is None:
+        return ""
+    if isinstance(value, str) and value in ERROR_CODES:
+        return float("nan")
+    if type(value) is float and value.is_integer():
+        return int(value)
+    return value
+
+
+def _iter_rows(path: str, sheet_name: str, select: Callable[[str], bool]) -> Iterator:
+    # Yields the selected header names first, then (values, has_data) per row.
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows)
+        indices = [i for i, name in enumerate(header) if name is not None and select(name)]
+        yield [header[i] for i in indices]
+
+        for row in rows:
+            values = [_convert_value(row[i]) if i < len(row) else "" for i in indices]
+            yield values, any(value is not None for value in row)
+    finally:
+        workbook.close()
+
+
+def read_sheet_header(path: str, sheet_name: str) -> List[str]:
+    rows = _iter_rows(path, sheet_name, lambda name: True)
+    try:
+        return next(rows)
+    finally:
+        rows.close()
+
+
+def read_sheet_rows(path: str, sheet_name: str, select: Callable[[str], bool]) -> Tuple[List[str], List[list]]:
+    rows = _iter_rows(path, sheet_name, select)
+    names = next(rows)
+
+    data = []
+    last_row_with_data = 0
+    for values, has_data in rows:
+        data.append(values)
+        if has_data:
+            last_row_with_data = len(data)
+
+    # Trailing blank rows are dropped, like pandas does.
+    return names, data[:last_row_with_data]
+
+
+def iter_sheet_chunks(path: str, sheet_name: str, select: Callable[[str], bool], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Streams the selected columns as frames of about chunk_rows rows,
+    each converted like read_sheet_columns converts the whole sheet."""
+    rows = _iter_rows(path, sheet_name, select)
+    names = next(rows)
+
+    chunk, blanks = [], []
+    for values, has_data in rows:
+        # Blank rows are held back until a row with data follows, so
+        # trailing ones are dropped.
+        if not has_data:
+            blanks.append(values)
+            continue
+
+        chunk += blanks
+        blanks = []
+        chunk.append(values)
+        if len(chunk) >= chunk_rows:
+            yield rows_to_frame(names, chunk)
+            chunk = []
+
+    if chunk:
+        yield rows_to_frame(names, chunk)
+
+
+def rows_to_frame(names: List[str], rows: List[list]) -> pd.DataFrame:
+    return TextParser([names] + rows, header=0, skip_blank_lines=False).read()
+
+
+def read_sheet_columns(path: str, sheet_name: str, select: Callable[[str], bool]) -> pd.DataFrame:
+    return rows_to_frame(*read_sheet_rows(path, sheet_name, select))
+
+
+def snapshot_path(folder: str, xlsx_checksum: str, sheet_name: str, selection_key: str) -> str:
+    key = text_checksum(xlsx_checksum, sheet_name, selection_key)[:16]
+    return os.path.join(folder, f"{SNAPSHOT_PREFIX}{key}{SNAPSHOT_SUFFIX}")
+
+
+def load_raw_frame(xlsx_path: str, sheet_name: str, select: Callable[[str], bool], path: str, force: bool = False) -> pd.DataFrame:
+    """Reads the selected columns from the snapshot at path, or from the
+    workbook when there is none or force is set, and rewrites the snapshot."""
+    folder = os.path.dirname(path)
+
+    hit = os.path.exists(path) and not force
+    cache("raw_snapshot", hit)
+    if hit:
+        return pd.read_pickle(path)
+
+    with stage("read_xlsx", path=xlsx_path) as record:
+        df = read_sheet_columns(xlsx_path, sheet_name, select)
+        record.update(rows=len(df), columns=df.shape[1])
+
+    os.makedirs(folder, exist_ok=True)
+    for stale in glob.glob(os.path.join(folder, f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}")):
+        os.remove(stale)
+    df.to_pickle(path, protocol=5)
+    return df
@@ -0,0 +1,260 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.cleaning import NOT_LISTED
+from src.profiling import stage
+
+CAS_COLUMN = "CAS/CFSAN number"
+NAME_COLUMN = "Name"
+SYNONYMS_COLUMN = "Synonyms"
+COLUMNS = [CAS_COLUMN, NAME_COLUMN, SYNONYMS_COLUMN]
+
+NGRAM = 3
+# Lowest Jaccard similarity of trigram sets a fuzzy match needs, one typo in
+# a ten letter name scores about 0.6.
+MIN_SCORE = 0.5
+# Fuzzy queries scored by one sparse product, bounds its memory.
+BATCH_SIZE = 256
+
+KINDS = ("name", "synonym")
+_NAME, _SYNONYM = 0, 1
+_SEPARATOR = "\x1f"
+_CAS_PATTERN = re.compile(r"^(\d{2,7})-?(\d{2})-?(\d)$")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+class Match(NamedTuple):
+    query: str
+    row: Optional[int]
+    cas: Optional[str]
+    name: Optional[str]
+    matched: Optional[str]
+    kind: Optional[str]
+    score: float
+
+
+def normalize_cas(value: str) -> str:
+    # "0000050-00-0", "50000" and " 50-00-0" are the same CAS number.
+    value = re.sub(r"\s+", "", str(value)).upper()
+    match = _CAS_PATTERN.match(value)
+    return f"{int(match[1])}-{match[2]}-{match[3]}" if match else value
+
+
+def normalize_name(value: str) -> str:
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(char for char in value if not unicodedata.combining(char)).casefold()
+    return _NON_WORD.sub(" ", value).strip()
+
+
+def ngrams(term: str, n: int = NGRAM) -> Set[str]:
+    padded = f" {term} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def _pack_strings(strings: Iterable[str]) -> np.ndarray:
+    # One utf-8 buffer instead of a fixed width unicode array, which would
+    # pad every synonym to the longest one.
+    return np.frombuffer("".join(f"{string}{_SEPARATOR}" for string in strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_strings(packed: np.ndarray) -> List[str]:
+    return packed.tobytes().decode("utf-8").split(_SEPARATOR)[:-1]
+
+
+def _csr(lists: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(lists) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(values) for values in lists])
+    indices = np.fromiter((value for values in lists for value in values), dtype=np.int32, count=indptr[-1])
+    return indptr, indices
+
+
+class SubstanceIndex:
+    """Finds substances of the cleaned data by CAS/CFSAN id, by exact name
+    or synonym and by trigram similarity of names and synonyms.
+
+    Names and synonyms are normalized into distinct terms. Every term keeps
+    the rows it names and its trigrams, fuzzy queries share trigrams with
+    all terms through one sparse product per batch.
+    """
+
+    def __init__(
+        self,
+        cas: List[str],
+        names: List[str],
+        terms: List[str],
+        term_rows: Tuple[np.ndarray, np.ndarray, np.ndarray],
+        grams: List[str],
+        term_grams: Tuple[np.ndarray, np.ndarray],
+        source: str = "",
+    ) -> None:
+        self.cas = cas
+        self.names = names
+        self.terms = terms
+        self.grams = grams
+        self.source = source
+        self._row_indptr, self._rows, self._kinds = term_rows
+        self._gram_indptr, self._term_grams = term_grams
+
+        self._cas_rows: Dict[str, List[int]] = {}
+        for row, value in enumerate(cas):
+            if value:
+                self._cas_rows.setdefault(normalize_cas(value), []).append(row)
+        self._term_ids = {term: i for i, term in enumerate(terms)}
+        self._gram_ids = {gram: i for i, gram in enumerate(grams)}
+        self._term_sizes = np.diff(self._gram_indptr)
+        self._matrix = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, source: str = "") -> "SubstanceIndex":
+        with stage("lookup_index") as record:
+            cas = df[CAS_COLUMN].fillna("").astype(str).str.strip().tolist()
+            names = df[NAME_COLUMN].fillna("").astype(str).str.strip().tolist()
+
+            # term -> {row: kind}, a row's name wins over an equal synonym.
+            postings: Dict[str, Dict[int, int]] = {}
+            for row, (name, synonyms) in enumerate(zip(names, df[SYNONYMS_COLUMN].fillna(NOT_LISTED).astype(str))):
+                values = [(name, _NAME)]
+                if synonyms != NOT_LISTED:
+                    values += [(synonym, _SYNONYM) for synonym in synonyms.split(";")]
+                for value, kind in values:
+                    term = normalize_name(value)
+                    if term:
+                        postings.setdefault(term, {}).setdefault(row, kind)
+
+            terms = list(postings)
+            row_indptr, rows = _csr([list(postings[term]) for term in terms])
+            kinds = np.fromiter((kind for term in terms for kind in postings[term].values()), dtype=np.uint8, count=len(rows))
+
+            gram_ids: Dict[str, int] = {}
+            term_grams = [sorted(gram_ids.setdefault(gram, len(gram_ids)) for gram in ngrams(term)) for term in terms]
+            record.update(rows=len(df), terms=len(terms), grams=len(gram_ids))
+
+        return cls(cas, names, terms, (row_indptr, rows, kinds), list(gram_ids), _csr(term_grams), source)
+
+    @classmethod
+    def load(cls, path: str) -> "SubstanceIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                _unpack_strings(data["cas"]),
+                _unpack_strings(data["names"]),
+                _unpack_strings(data["terms"]),
+                (data["row_indptr"], data["rows"], data["kinds"]),
+                _unpack_strings(data["grams"]),
+                (data["gram_indptr"], data["term_grams"]),
+                str(data["source"]),
+            )
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                cas=_pack_strings(self.cas),
+                names=_pack_strings(self.names),
+                terms=_pack_strings(self.terms),
+                row_indptr=self._row_indptr,
+                rows=self._rows,
+                kinds=self._kinds,
+                grams=_pack_strings(self.grams),
+                gram_indptr=self._gram_indptr,
+                term_grams=self._term_grams,
+                source=np.array(self.source),
+            )
+
+    def __len__(self) -> int:
+        return len(self.cas)
+
+    def by_cas(self, value: str) -> List[int]:
+        return self._cas_rows.get(normalize_cas(value), [])
+
+    def _term_matches(self, term_id: int) -> List[Tuple[int, int]]:
+        start, end = self._row_indptr[term_id], self._row_indptr[term_id + 1]
+        return list(zip(self._rows[start:end].tolist(), self._kinds[start:end].tolist()))
+
+    def by_name(self, value: str) -> List[int]:
+        term_id = self._term_ids.get(normalize_name(value))
+        return [] if term_id is None else [row for row, _ in self._term_matches(term_id)]
+
+    def _term_matrix(self):
+        from scipy.sparse import csr_matrix
+
+        # Transposed terms x grams matrix, a batch of queries times it counts
+        # the trigrams every query shares with every term.
+        if self._matrix is None:
+            data = np.ones(len(self._term_grams), dtype=np.int32)
+            matrix = csr_matrix((data, self._term_grams, self._gram_indptr), shape=(len(self.terms), len(self.grams)))
+            self._matrix = matrix.T.tocsr()
+        return self._matrix
+
+    def fuzzy(self, values: List[str], limit: int = 5, min_score: float = MIN_SCORE) -> List[List[Tuple[int, float]]]:
+        """Returns up to limit (term id, score) pairs for every value, best
+        first, scored by Jaccard similarity of their trigram sets."""
+        from scipy.sparse import csr_matrix
+
+        results = []
+        for start in range(0, len(values), BATCH_SIZE):
+            batch = [ngrams(normalize_name(value)) for value in values[start:start + BATCH_SIZE]]
+            known = [[self._gram_ids[gram] for gram in grams if gram in self._gram_ids] for grams in batch]
+            indptr, indices = _csr(known)
+            queries = csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(batch), len(self.grams)))
+            shared = queries @ self._term_matrix()
+
+            for i, grams in enumerate(batch):
+                terms = shared.indices[shared.indptr[i]:shared.indptr[i + 1]]
+                counts = shared.data[shared.indptr[i]:shared.indptr[i + 1]]
+                scores = counts / (len(grams) + self._term_sizes[terms] - counts)
+                keep = np.flatnonzero(scores >= min_score)
+                best = keep[np.argsort(-scores[keep], kind="stable")[:limit]]
+                results.append([(int(terms[j]), float(scores[j])) for j in best])
+        return results
+
+    def _match(self, query: str, row: int, matched: str, kind: str, score: float) -> Match:
+        return Match(query, row, self.cas[row], self.names[row], matched, kind, round(score, 4))
+
+    def _lookup(self, queries: List[str], limit: int, min_score: float) -> Dict[str, List[Match]]:
+        unique = list(dict.fromkeys(queries))
+        with stage("lookup", queries=len(queries), unique=len(unique)) as record:
+            found: Dict[str, List[Match]] = {}
+            pending = []
+            for query in unique:
+                rows = self.by_cas(query)
+                if rows:
+                    found[query] = [self._match(query, row, self.cas[row], "cas", 1.0) for row in rows[:limit]]
+                    continue
+
+                term_id = self._term_ids.get(normalize_name(query))
+                if term_id is None:
+                    pending.append(query)
+                    continue
+                found[query] = [self._match(query, row, self.terms[term_id], KINDS[kind], 1.0) for row, kind in self._term_matches(term_id)[:limit]]
+
+            # A substance's name and synonyms often match together, each row
+            # is kept once with its best term.
+            for query, candidates in zip(pending, self.fuzzy(pending, 4 * limit, min_score) if pending else []):
+                matches = {}
+                for term_id, score in candidates:
+                    for row, kind in self._term_matches(term_id):
+                        if row not in matches and len(matches) < limit:
+                            matches[row] = self._match(query, row, self.terms[term_id], KINDS[kind], score)
+                found[query] = list(matches.values())
+
+            record.update(fuzzy=len(pending), matched=sum(bool(matches) for matches in found.values()))
+        return found
+
+    def lookup(self, query: str, limit: int = 5, min_score: float = MIN_SCORE) -> List[Match]:
+        return self._lookup([query], limit, min_score)[query]
+
+    def lookup_many(self, queries: Iterable[str], limit: int = 1, min_score: float = MIN_SCORE) -> pd.DataFrame:
+        """Matches every query by CAS/CFSAN id, then by exact name or synonym
+        and only then by fuzzy name. Queries without a match keep one empty
+        row, so the result lines up with the input list."""
+        queries = list(queries)
+        found = self._lookup(queries, limit, min_score)
+
+        results = []
+        for query in queries:
+            results += found[query] or [Match(query, None, None, None, None, None, 0.0)]
+        return pd.DataFrame(results, columns=Match._fields).astype({"row": "Int64"})
@@ -0,0 +1,244 @@
+import importlib.util
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from src.ffc_db import FFC_DB, MATERIALS, MODEL_FILE, REGRESSION_COLUMNS, SWEEP_FILE
+from src.hashing import file_checksum, text_checksum
+from src.profiling import cache, event, stage
+
+MANIFEST_FILE = "pipeline.json"
+DEFAULT_PARAMS = {"jobs": 1, "method": "pearson", "top_k": None, "threshold": None, "folds": 5}
+ANALYSIS_STAGES = ["correlations", "model", "plots"]
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Stage(NamedTuple):
+    run: Callable[[FFC_DB, dict], None]
+    outputs: Callable[[FFC_DB, dict], List[str]]
+    deps: List[str] = []
+    # constants.toml keys, run parameters, modules and extra input files that are part of the fingerprint
+    config: List[str] = []
+    params: List[str] = []
+    code: List[str] = []
+    inputs: Callable[[FFC_DB, dict], List[str]] = lambda db, params: []
+
+
+def _download(db: FFC_DB, params: dict) -> None:
+    # Without an url a workbook placed by hand is kept as it is.
+    if db.config.get("api_xl_url") or not db.is_downloaded:
+        db.download_xlsx()
+
+
+def _correlations(db: FFC_DB, params: dict) -> None:
+    db.save_correlations(db.get_features(), params["method"], params["top_k"], params["threshold"], params["jobs"])
+
+
+def _correlations_outputs(db: FFC_DB, params: dict) -> List[str]:
+    return [db.correlations_path(params["method"], params["top_k"] is not None or params["threshold"] is not None)]
+
+
+def _model(db: FFC_DB, params: dict) -> None:
+    db.run_regression(db.get_features(REGRESSION_COLUMNS), save_model=True, jobs=params["jobs"])
+
+
+def _model_outputs(db: FFC_DB, params: dict) -> List[str]:
+    from src.visualization import REGRESSION_FIGURES
+
+    return [MODEL_FILE] + list(REGRESSION_FIGURES.values())
+
+
+def _plots(db: FFC_DB, params: dict) -> None:
+    from src.stats import material_cooccurrence
+    from src.visualization import PLOT_COLUMNS, material_figure_jobs, prepare_data_for_material_plots, render_figures
+
+    df = db.get_features(PLOT_COLUMNS)
+    material_data = prepare_data_for_material_plots(df, material_cooccurrence(df, MATERIALS))
+    render_figures(material_figure_jobs(df, material_data), db.figure_cache_folder, params["jobs"])
+
+
+def _plots_outputs(db: FFC_DB, params: dict) -> List[str]:
+    from src.visualization import MATERIAL_FIGURES
+
+    return list(MATERIAL_FIGURES.values())
+
+
+STAGES: Dict[str, Stage] = {
+    "download": Stage(
+        _download,
+        lambda db, params: [db.config.get("ffc_db_file")],
+        config=["api_xl_url", "api_record_url"],
+        code=["src.download"],
+    ),
+    # Chunked cleaning streams the workbook itself, so it needs no snapshot.
+    # The stage only runs when stale or forced, so it always rebuilds it.
+    "raw": Stage(
+        lambda db, params: None if db.is_chunked else db.read_raw_data(force=True),
+        lambda db, params: [] if db.is_chunked else [db.raw_snapshot_path()],
+        deps=["download"],
+        config=["data_sheet_name"],
+        code=["src.ingest", "src.cleaning"],
+    ),
+    "clean": Stage(
+        lambda db, params: db.clean_data(jobs=params["jobs"]),
+        lambda db, params: [db.config.get("cleaned_file")],
+        deps=["download", "raw"],
+        config=["clean_chunk_rows", "inventory_files"],
+        code=["src.cleaning", "src.chunked", "src.ffc_db"],
+        inputs=lambda db, params: db.config.get("inventory_files", []),
+    ),
+    "sqlite": Stage(
+        lambda db, params: db.export_sqlite(),
+        lambda db, params: [db.sqlite_path],
+        deps=["download", "raw", "clean"],
+        code=["src.relational", "src.ffc_db"],
+    ),
+    "features": Stage(
+        lambda db, params: db.save_features(),
+        lambda db, params: [db.features_path],
+        deps=["clean"],
+        code=["src.ffc_db"],
+    ),
+    "correlations": Stage(
+        _correlations,
+        _correlations_outputs,
+        deps=["features"],
+        params=["method", "top_k", "threshold"],
+        code=["src.correlation"],
+    ),
+    "model": Stage(
+        _model,
+        _model_outputs,
+        deps=["features"],
+        code=["src.ffc_db", "src.visualization"],
+    ),
+    "sweep": Stage(
+        lambda db, params: db.run_sweep(db.get_features(), folds=params["folds"], jobs=params["jobs"]),
+        lambda db, params: [SWEEP_FILE],
+        deps=["features"],
+        params=["folds"],
+        code=["src.sweep"],
+    ),
+    "plots": Stage(
+        _plots,
+        _plots_outputs,
+        deps=["features"],
+        code=["src.visualization", "src.stats"],
+    ),
+}
+
+
+def _run_stage(db: FFC_DB, name: str, params: dict) -> None:
+    with stage(f"pipeline.{name}"):
+        STAGES[name].run(db, params)
+
+
+def _run_stage_in_process(config: str, name: str, params: dict) -> None:
+    _run_stage(FFC_DB(config=config), name, params)
+
+
+class Pipeline:
+    """Runs FFC_DB stages in dependency order and skips every stage whose
+    inputs, config, parameters and code match its last successful run."""
+
+    def __init__(self, db: FFC_DB) -> None:
+        self.db = db
+        self.manifest_path = os.path.join(db.config.get("data_folder"), MANIFEST_FILE)
+        self.manifest = {"stages": {}, "files": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+
+    def _save_manifest(self) -> None:
+        with open(f"{self.manifest_path}.tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def file_hash(self, path: str) -> str:
+        # Hashes are reused while size and mtime are unchanged.
+        stat = os.stat(path)
+        cached = self.manifest["files"].get(path)
+        if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+            return cached["md5"]
+
+        checksum = file_checksum(path)
+        self.manifest["files"][path] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "md5": checksum}
+        return checksum
+
+    def outputs(self, name: str, params: dict) -> List[str]:
+        return STAGES[name].outputs(self.db, params)
+
+    def fingerprint(self, name: str, params: dict) -> str:
+        spec = STAGES[name]
+        parts = [name]
+        parts += [f"{key}={self.db.config.get(key)}" for key in spec.config]
+        parts += [f"{key}={params[key]}" for key in spec.params]
+        parts += [f"{module}={self.file_hash(importlib.util.find_spec(module).origin)}" for module in spec.code]
+        for dep in spec.deps:
+            parts += [f"{path}={self.file_hash(path)}" for path in self.outputs(dep, params)]
+        parts += [f"{path}={self.file_hash(path)}" for path in spec.inputs(self.db, params)]
+        return text_checksum(*parts)
+
+    def is_fresh(self, name: str, params: dict, fingerprint: Optional[str] = None) -> bool:
+        if not all(os.path.exists(path) for path in self.outputs(name, params)):
+            return False
+        return self.manifest["stages"].get(name) == (fingerprint or self.fingerprint(name, params))
+
+    def plan(self, targets: Iterable[str]) -> List[List[str]]:
+        """Groups the targets and their upstream stages into levels, stages
+        of one level only depend on earlier levels."""
+        levels: Dict[str, int] = {}
+
+        def visit(name: str, path: tuple) -> int:
+            if name not in STAGES:
+                raise PipelineError(f"Unknown stage: {name!r}, expected one of {list(STAGES)}")
+            if name in path:
+                raise PipelineError(f"Stage {name!r} depends on itself")
+            if name not in levels:
+                levels[name] = 1 + max((visit(dep, path + (name,)) for dep in STAGES[name].deps), default=-1)
+            return levels[name]
+
+        for target in targets:
+            visit(target, ())
+
+        grouped = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+        for name, level in levels.items():
+            grouped[level].append(name)
+        return grouped
+
+    def _run_level(self, names: List[str], params: dict) -> None:
+        jobs = params["jobs"]
+        if jobs > 1 and len(names) > 1:
+            # Independent stages run side by side, each in its own process with one worker.
+            with ProcessPoolExecutor(max_workers=min(jobs, len(names))) as executor:
+                futures = [executor.submit(_run_stage_in_process, self.db.config_path, name, {**params, "jobs": 1}) for name in names]
+                for future in futures:
+                    future.result()
+            return
+
+        for name in names:
+            _run_stage(self.db, name, params)
+
+    def run(self, targets: Iterable[str], params: Optional[dict] = None, force: Iterable[str] = (), jobs: int = 1) -> List[str]:
+        params = {**DEFAULT_PARAMS, **(params or {}), "jobs": jobs}
+        force = set(force)
+        ran = []
+
+        for level in self.plan(targets):
+            fingerprints = {name: self.fingerprint(name, params) for name in level}
+            stale = [name for name in level if name in force or not self.is_fresh(name, params, fingerprints[name])]
+            for name in level:
+                cache("pipeline", name not in stale)
+                if name not in stale:
+                    event("pipeline.up_to_date", stage=name)
+
+            self._run_level(stale, params)
+            self.manifest["stages"].update({name: fingerprints[name] for name in stale})
+            self._save_manifest()
+            ran += stale
+
+        return ran
@@ -0,0 +1,106 @@
+import cProfile
+import json
+import logging
+import os
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger("ffc_db.metrics")
+
+
+class Metrics:
+    """Times stages, tracks their peak memory and counts cache hits and
+    misses. Everything is reported as one JSON object per log line on the
+    ffc_db.metrics logger."""
+
+    def __init__(self) -> None:
+        self.trace_memory = False
+        self.profile_stage: Optional[str] = None
+        self.profile_folder = "profiles"
+        self.counters: Counter = Counter()
+        self._peaks: List[int] = []
+
+    def configure(self, trace_memory: bool = True, profile_stage: Optional[str] = None, profile_folder: str = "profiles") -> None:
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profile_folder = profile_folder
+
+    def event(self, name: str, **fields) -> None:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({"event": name, **fields}, default=str))
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def cache(self, name: str, hit: bool) -> None:
+        self.count(f"{name}.{'hit' if hit else 'miss'}")
+
+    def report(self) -> None:
+        self.event("counters", **dict(sorted(self.counters.items())))
+
+    @contextmanager
+    def stage(self, name: str, **fields) -> Iterator[dict]:
+        """Measures the block, callers add sizes such as rows and columns
+        to the yielded record."""
+        record = dict(fields)
+
+        tracing = self.trace_memory
+        started = tracing and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        if tracing:
+            # tracemalloc keeps one peak, so the enclosing stage's peak so far
+            # is saved before it is reset for this one.
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        if profiler:
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 4)
+
+            if profiler:
+                profiler.disable()
+                os.makedirs(self.profile_folder, exist_ok=True)
+                record["cprofile"] = os.path.join(self.profile_folder, f"{name}.prof")
+                profiler.dump_stats(record["cprofile"])
+
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                if started:
+                    tracemalloc.stop()
+                record["peak_mb"] = round(peak / 2**20, 2)
+
+            self.event("stage", stage=name, **record)
+
+
+METRICS = Metrics()
+
+stage = METRICS.stage
+event = METRICS.event
+count = METRICS.count
+cache = METRICS.cache
+
+
+def enable(path: Optional[str] = None, trace_memory: bool = True, profile_stage: Optional[str] = None, profile_folder: str = "profiles") -> None:
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    METRICS.configure(trace_memory, profile_stage, profile_folder)
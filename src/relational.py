@@ -0,0 +1,246 @@
+import os
+import re
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.cleaning import LISTS_COLUMNS, MOST_VALUABLE_COLUMNS, NOT_LISTED, TONNAGE_PATTERN, YES, ColumnSpec
+from src.profiling import stage
+
+SQLITE_FILE = "FFCdb.sqlite"
+
+# "yes; ..." columns, the text after the leading yes/no is split into fields.
+LIST_SPECS: List[ColumnSpec] = [spec for spec in MOST_VALUABLE_COLUMNS + LISTS_COLUMNS if spec[2] == "yes_no"]
+TONNAGE_HEADER = next(source for source, target, _ in MOST_VALUABLE_COLUMNS if target == "max_tonnage")
+# Headers whose "+ ..." part does not name one field per ";" part of the values.
+FIELD_OVERRIDES = {
+    "CPPdb": ["List", "Considered fc"],
+}
+
+SCHEMA = [
+    "CREATE TABLE list_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, header TEXT NOT NULL, fields TEXT)",
+    "CREATE TABLE synonyms (substance_id INTEGER NOT NULL REFERENCES substances(id), synonym TEXT NOT NULL)",
+    "CREATE TABLE materials (substance_id INTEGER NOT NULL REFERENCES substances(id), material TEXT NOT NULL)",
+    "CREATE TABLE sources (substance_id INTEGER NOT NULL REFERENCES substances(id), source TEXT NOT NULL)",
+    "CREATE TABLE lists (substance_id INTEGER NOT NULL REFERENCES substances(id), list_id INTEGER NOT NULL REFERENCES list_names(id), detail TEXT)",
+    "CREATE TABLE list_fields (substance_id INTEGER NOT NULL REFERENCES substances(id), list_id INTEGER NOT NULL REFERENCES list_names(id), position INTEGER NOT NULL, field TEXT, value TEXT NOT NULL)",
+    # Lists by name for ad-hoc queries, the tables keep integer ids.
+    "CREATE VIEW list_values AS SELECT f.substance_id, n.name AS list, f.position, f.field, f.value FROM list_fields f JOIN list_names n ON n.id = f.list_id",
+    # Open bands such as "100+" have no max_tonnage.
+    "CREATE TABLE reach_tonnage (substance_id INTEGER NOT NULL REFERENCES substances(id), min_tonnage REAL NOT NULL, max_tonnage REAL)",
+    "CREATE VIRTUAL TABLE substance_search USING fts5(name, synonyms, tokenize='unicode61 remove_diacritics 2')",
+]
+# Created after the bulk insert, which is faster than keeping them up to date.
+INDEXES = [
+    "CREATE INDEX substances_cas ON substances(cas_cfsan_number)",
+    "CREATE INDEX synonyms_substance ON synonyms(substance_id)",
+    "CREATE INDEX synonyms_synonym ON synonyms(synonym COLLATE NOCASE)",
+    "CREATE INDEX materials_material ON materials(material, substance_id)",
+    "CREATE INDEX materials_substance ON materials(substance_id)",
+    "CREATE INDEX sources_source ON sources(source, substance_id)",
+    "CREATE INDEX lists_list ON lists(list_id, substance_id)",
+    "CREATE INDEX lists_substance ON lists(substance_id, list_id)",
+    "CREATE INDEX list_fields_value ON list_fields(list_id, field, value)",
+    "CREATE INDEX list_fields_substance ON list_fields(substance_id, list_id)",
+    "CREATE INDEX reach_tonnage_substance ON reach_tonnage(substance_id)",
+]
+SQL_TYPES = {"boolean": "INTEGER", "integer": "INTEGER", "floating": "REAL", "mixed-integer-float": "REAL"}
+
+
+def sql_name(column: str) -> str:
+    return re.sub(r"\W+", "_", column).strip("_").lower()
+
+
+def sql_type(series: pd.Series) -> str:
+    # Flags of merged inventories are objects because of missing values.
+    return SQL_TYPES.get(pd.api.types.infer_dtype(series, skipna=True)) or ("REAL" if series.dtype.kind == "f" else "TEXT")
+
+
+def header_fields(header: str) -> List[str]:
+    # "on EU CoRAP list? + Status + Year + ..." names the parts that follow
+    # the leading yes, "+ N DataSources; N PubmedArticles" names two.
+    parts = " ".join(header.split()).split(" + ")[1:]
+    return [field.strip() for part in parts for field in part.split(";") if field.strip()]
+
+
+def field_names(source: str, target: str) -> List[Optional[str]]:
+    return FIELD_OVERRIDES.get(target) or header_fields(source) or [None]
+
+
+def list_names() -> pd.DataFrame:
+    return pd.DataFrame({
+        "id": np.arange(1, len(LIST_SPECS) + 1),
+        "name": [target for _, target, _ in LIST_SPECS],
+        "header": [" ".join(source.split()) for source, _, _ in LIST_SPECS],
+        "fields": ["; ".join(filter(None, field_names(source, target))) or None for source, target, _ in LIST_SPECS],
+    })
+
+
+def _parse_list_value(value) -> Tuple[bool, Optional[str], List[str]]:
+    value = str(value).strip()
+    if not value.startswith(YES):
+        return False, None, []
+    detail = value.partition(";")[2].strip()
+    return True, detail or None, [part.strip() for part in detail.split(";") if part.strip()]
+
+
+def list_fields(raw: pd.DataFrame, ids: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Long tables of every list inclusion with its detail text and of the
+    detail split into fields. Parts beyond the named fields keep the last
+    field's name, so repeated reasons or tonnage bands are one row each."""
+    lists, fields = [], []
+    for list_id, (source, target, _) in enumerate(LIST_SPECS, start=1):
+        if source not in raw.columns:
+            continue
+
+        # Cells repeat a lot, so parse each distinct one only once. Missing
+        # cells get code -1, which picks the empty entry appended last.
+        codes, uniques = pd.factorize(raw[source])
+        parsed = [_parse_list_value(value) for value in uniques] + [(False, None, [])]
+        included = np.array([entry[0] for entry in parsed])[codes]
+        rows = np.flatnonzero(included)
+        details = np.array([entry[1] for entry in parsed], dtype=object)
+        lists.append(pd.DataFrame({"substance_id": ids[rows], "list_id": list_id, "detail": details[codes[rows]]}))
+
+        counts = np.array([len(entry[2]) for entry in parsed])
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        row_counts = counts[codes[rows]]
+        position = np.arange(row_counts.sum()) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        values = np.array([part for entry in parsed for part in entry[2]], dtype=object)
+        names = np.array(field_names(source, target), dtype=object)
+        fields.append(pd.DataFrame({
+            "substance_id": np.repeat(ids[rows], row_counts),
+            "list_id": list_id,
+            "position": position,
+            "field": names[np.minimum(position, len(names) - 1)],
+            "value": values[np.repeat(starts[codes[rows]], row_counts) + position],
+        }))
+
+    if not lists:
+        # None of the list headers is in this sheet.
+        return pd.DataFrame(columns=["substance_id", "list_id", "detail"]), pd.DataFrame(columns=["substance_id", "list_id", "position", "field", "value"])
+    return pd.concat(lists, ignore_index=True), pd.concat(fields, ignore_index=True)
+
+
+def reach_tonnage(raw: pd.DataFrame, ids: np.ndarray) -> pd.DataFrame:
+    values = raw[TONNAGE_HEADER].astype("string")
+    values = values[values.str.startswith(YES).fillna(False)]
+    bands = values.str.extractall(TONNAGE_PATTERN).astype(float)
+    return pd.DataFrame({
+        "substance_id": ids[raw.index.get_indexer(bands.index.get_level_values(0))],
+        "min_tonnage": bands[0].to_numpy(),
+        "max_tonnage": bands[1].to_numpy(),
+    })
+
+
+def flag_table(clean: pd.DataFrame, ids: np.ndarray, columns: List[str], name: str) -> pd.DataFrame:
+    matrix = clean[columns].fillna(False).to_numpy(dtype=bool)
+    rows, cols = np.nonzero(matrix)
+    return pd.DataFrame({"substance_id": ids[rows], name: np.array(columns, dtype=object)[cols]})
+
+
+def synonyms(clean: pd.DataFrame, ids: np.ndarray) -> pd.DataFrame:
+    values = clean["Synonyms"].astype("string").where(lambda series: series != NOT_LISTED)
+    parts = values.str.split(";").explode().str.strip()
+    parts = parts[parts.notna() & (parts != "")]
+    return pd.DataFrame({"substance_id": ids[clean.index.get_indexer(parts.index)], "synonym": parts.to_numpy()})
+
+
+class SqliteExport:
+    """Writes the cleaned substances and the parsed "+ why" detail of the raw
+    sheet into one SQLite database, chunk by chunk. The database is built
+    next to the target and replaces it when complete."""
+
+    def __init__(self, path: str, materials: List[str], sources: List[str]) -> None:
+        self.path = path
+        self.materials = materials
+        self.sources = sources
+        self.rows = 0
+        self._temp_path = f"{path}.tmp"
+        self._connection = None
+        self._columns: List[str] = []
+
+    def __enter__(self) -> "SqliteExport":
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+        self._connection = sqlite3.connect(self._temp_path)
+        # Nothing to recover from if the build fails, the file is discarded.
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        return self
+
+    def _insert(self, table: str, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        columns = ", ".join(df.columns)
+        placeholders = ", ".join("?" * df.shape[1])
+        values = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        self._connection.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", values)
+
+    def _substances(self, clean: pd.DataFrame) -> pd.DataFrame:
+        # Flags and lists live in their long tables, everything else is a
+        # column of the core table.
+        drop = set(self.materials + self.sources + [target for _, target, _ in LIST_SPECS] + ["Synonyms"])
+        substances = clean[[column for column in clean.columns if column not in drop]]
+        substances = substances.set_axis([sql_name(column) for column in substances.columns], axis=1)
+
+        if not self._columns:
+            self._columns = list(substances.columns)
+            definitions = ", ".join(f"{name} {sql_type(substances[name])}" for name in self._columns)
+            self._connection.execute(f"CREATE TABLE substances (id INTEGER PRIMARY KEY, {definitions})")
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+            self._insert("list_names", list_names())
+        return substances.reindex(columns=self._columns)
+
+    def write(self, clean: pd.DataFrame, raw: pd.DataFrame) -> None:
+        """Adds the rows of one cleaned chunk and the raw chunk it was cleaned from."""
+        clean = clean.reset_index(drop=True)
+        raw = raw.reset_index(drop=True)
+        ids = np.arange(self.rows + 1, self.rows + len(clean) + 1)
+
+        substances = self._substances(clean)
+        substances.insert(0, "id", ids)
+        self._insert("substances", substances)
+
+        self._insert("synonyms", synonyms(clean, ids))
+        search = clean["Synonyms"].where(clean["Synonyms"] != NOT_LISTED)
+        self._insert("substance_search", pd.DataFrame({"rowid": ids, "name": clean["Name"].to_numpy(), "synonyms": search.to_numpy()}))
+
+        self._insert("materials", flag_table(clean, ids, [column for column in self.materials if column in clean.columns], "material"))
+        self._insert("sources", flag_table(clean, ids, [column for column in self.sources if column in clean.columns], "source"))
+
+        lists, fields = list_fields(raw, ids)
+        self._insert("lists", lists)
+        self._insert("list_fields", fields)
+        if TONNAGE_HEADER in raw.columns:
+            self._insert("reach_tonnage", reach_tonnage(raw, ids))
+
+        self.rows += len(clean)
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                with stage("sqlite_indexes"):
+                    for statement in INDEXES:
+                        self._connection.execute(statement)
+                    self._connection.execute("ANALYZE")
+                self._connection.commit()
+        finally:
+            self._connection.close()
+
+        if exc_type is None:
+            os.replace(self._temp_path, self.path)
+        elif os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def export_sqlite(path: str, chunks: Iterable[Tuple[pd.DataFrame, pd.DataFrame]], materials: List[str], sources: List[str]) -> int:
+    with stage("sqlite", path=path) as record:
+        with SqliteExport(path, materials, sources) as export:
+            for clean, raw in chunks:
+                export.write(clean, raw)
+        record["rows"] = export.rows
+    return export.rows
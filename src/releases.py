@@ -0,0 +1,302 @@
+import datetime
+import json
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src import cleaning
+from src.chunked import clean_chunks, frame_to_table, spec_schema
+from src.cleaning import LIST_FLAGS, MATERIALS, MOST_VALUABLE_COLUMNS, ColumnSpec
+from src.hashing import file_checksum, text_checksum
+from src.profiling import stage
+
+CAS_COLUMN = "CAS/CFSAN number"
+NAME_COLUMN = "Name"
+HASH_COLUMN = "row_hash"
+RELEASE_COLUMN = "Release"
+# Tells apart substances that share a CAS number, or have none, in diffs.
+OCCURRENCE_COLUMN = "occurrence"
+PAIR_COLUMN = "pair"
+
+ROWS_FILE = "rows.parquet"
+MEMBERS_FILE = "members.parquet"
+META_FILE = "releases.json"
+
+# Columns compared by diffs, changes elsewhere (names, synonyms, sources)
+# do not make a substance "changed".
+DIFF_GROUPS = {
+    "hazard": [target for _, target, kind in MOST_VALUABLE_COLUMNS if kind in ("yes_no", "numeric", "listed")],
+    "list": LIST_FLAGS,
+    "material": MATERIALS,
+}
+CHANGES = ("added", "removed", "changed")
+
+
+def _occurrences(members: pd.DataFrame, keys: List[str]) -> pd.Series:
+    # Repeated keys, missing CAS numbers included, count up in sheet order.
+    return members.groupby(keys, dropna=False).cumcount().rename(OCCURRENCE_COLUMN)
+
+
+def _keyed(members: pd.DataFrame, keys: List[str]) -> pd.MultiIndex:
+    return pd.MultiIndex.from_frame(pd.concat([members[keys], _occurrences(members, keys)], axis=1))
+
+
+class ReleaseError(Exception):
+    pass
+
+
+class Release(NamedTuple):
+    name: str
+    record_id: str
+    published: str
+    file_name: str
+    url: str
+    checksum: Optional[str] = None
+
+
+def release_from_record(record: dict) -> Optional[Release]:
+    metadata = record.get("metadata", {})
+    name = str(metadata.get("version") or metadata.get("publication_date") or record.get("id"))
+    for entry in record.get("files", []):
+        links = entry.get("links", {})
+        url = links.get("self") or links.get("download")
+        if entry.get("key", "").endswith(".xlsx") and url:
+            return Release(name, str(record.get("id")), metadata.get("publication_date", ""), entry["key"], url, entry.get("checksum"))
+    return None
+
+
+def discover_releases(records: Iterable[dict]) -> List[Release]:
+    """Turns Zenodo record versions into releases, oldest first. Versions
+    without a workbook are skipped, repeated version names get the record id."""
+    releases: Dict[str, Release] = {}
+    for release in filter(None, map(release_from_record, records)):
+        if release.name in releases:
+            release = release._replace(name=f"{release.name}-{release.record_id}")
+        releases[release.name] = release
+    return sorted(releases.values(), key=lambda release: (release.published, release.record_id))
+
+
+def file_name(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", name)
+
+
+def row_salt(columns: List[str]) -> str:
+    # Rows are only reused while the header and the cleaning code match.
+    return text_checksum(file_checksum(cleaning.__file__), *columns)[:16]
+
+
+def _canonical(series: pd.Series) -> pd.Series:
+    # A column read as float in one release because of blanks and as int in
+    # another must hash the same, so whole floats are written like ints.
+    missing = series.isna()
+    # astype(str) can rewrite an object column's values in place, which
+    # would turn the caller's missing cells into "nan".
+    text = series.copy().astype(str)
+    if pd.api.types.is_float_dtype(series):
+        whole = ~missing & (series == np.floor(series))
+        text[whole] = series[whole].astype(np.int64).astype(str)
+    return text.mask(missing, "")
+
+
+def row_hashes(df: pd.DataFrame, salt: str) -> np.ndarray:
+    canonical = pd.DataFrame({name: _canonical(df[name]) for name in df.columns}, index=df.index)
+    return pd.util.hash_pandas_object(canonical, index=False, hash_key=salt).to_numpy()
+
+
+def _write_table(table: pa.Table, path: str) -> None:
+    pq.write_table(table, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+class ReleaseStore:
+    """Cleaned rows of every stored FFCdb release, kept once per distinct
+    raw row. A release is the ordered list of its rows' hashes with their
+    CAS numbers, so a substance unchanged between releases is cleaned and
+    stored once and diffs only compare rows whose hashes differ."""
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.rows_path = os.path.join(folder, ROWS_FILE)
+        self.members_path = os.path.join(folder, MEMBERS_FILE)
+        self.meta_path = os.path.join(folder, META_FILE)
+        self.meta: Dict[str, dict] = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                self.meta = json.load(f)
+
+    def _save_meta(self) -> None:
+        with open(f"{self.meta_path}.tmp", "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(f"{self.meta_path}.tmp", self.meta_path)
+
+    @property
+    def releases(self) -> List[str]:
+        return sorted(self.meta, key=lambda name: (self.meta[name].get("published") or "", self.meta[name]["added"]))
+
+    def is_current(self, name: str, columns: List[str]) -> bool:
+        return self.meta.get(name, {}).get("salt") == row_salt(columns)
+
+    def _check(self, name: str) -> None:
+        if name not in self.meta:
+            raise ReleaseError(f"Unknown release: {name!r}, stored releases are {self.releases}")
+
+    def _members(self, name: Optional[str] = None) -> pd.DataFrame:
+        if not os.path.exists(self.members_path):
+            return pd.DataFrame({RELEASE_COLUMN: [], CAS_COLUMN: [], HASH_COLUMN: np.array([], dtype=np.uint64)})
+        filters = [(RELEASE_COLUMN, "==", name)] if name is not None else None
+        return pq.read_table(self.members_path, filters=filters).to_pandas()
+
+    def _rows(self, hashes: np.ndarray, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        available = pq.read_schema(self.rows_path).names
+        columns = [column for column in (columns or available) if column in available and column != HASH_COLUMN]
+        if not len(hashes):
+            return pq.read_schema(self.rows_path).empty_table().select([HASH_COLUMN] + columns).to_pandas().set_index(HASH_COLUMN)
+        table = pq.read_table(self.rows_path, columns=[HASH_COLUMN] + columns, filters=[(HASH_COLUMN, "in", pa.array(np.unique(hashes)))])
+        return table.to_pandas().set_index(HASH_COLUMN)
+
+    def add(
+        self,
+        name: str,
+        chunks: Iterable[pd.DataFrame],
+        columns: List[str],
+        specs: List[List[ColumnSpec]],
+        meta: Optional[dict] = None,
+        jobs: int = 1,
+    ) -> dict:
+        """Stores a release from its raw chunks, only rows whose raw content
+        is not in the store yet are cleaned. Replaces a release of the same name."""
+        os.makedirs(self.folder, exist_ok=True)
+        salt = row_salt(columns)
+        rows = pq.read_table(self.rows_path) if os.path.exists(self.rows_path) else None
+        seen = set(rows.column(HASH_COLUMN).to_pylist()) if rows is not None else set()
+        hashes: List[np.ndarray] = []
+
+        def new_rows() -> Iterator[pd.DataFrame]:
+            for chunk in chunks:
+                chunk_hashes = row_hashes(chunk, salt)
+                hashes.append(chunk_hashes)
+                new = np.zeros(len(chunk), dtype=bool)
+                for i, value in enumerate(chunk_hashes.tolist()):
+                    if value not in seen:
+                        seen.add(value)
+                        new[i] = True
+                if new.any():
+                    yield chunk[new].set_axis(chunk_hashes[new])
+
+        with stage("release_add", release=name, jobs=jobs) as record:
+            schema = spec_schema(specs).insert(0, pa.field(HASH_COLUMN, pa.uint64()))
+            tables = [rows] if rows is not None else []
+            for cleaned in clean_chunks(new_rows(), specs, jobs):
+                tables.append(frame_to_table(cleaned.rename_axis(HASH_COLUMN).reset_index(), schema))
+            cleaned_rows = sum(len(table) for table in tables) - (len(rows) if rows is not None else 0)
+            rows = pa.concat_tables(tables, promote=True) if tables else schema.empty_table()
+
+            order = np.concatenate(hashes) if hashes else np.array([], dtype=np.uint64)
+            cas = rows.select([HASH_COLUMN, CAS_COLUMN]).to_pandas().set_index(HASH_COLUMN)[CAS_COLUMN].reindex(order)
+            members = self._members()
+            members = pd.concat([
+                members[members[RELEASE_COLUMN] != name],
+                pd.DataFrame({RELEASE_COLUMN: name, CAS_COLUMN: cas.to_numpy(), HASH_COLUMN: order}),
+            ], ignore_index=True)
+
+            # Rows of replaced releases that no release uses any more are dropped.
+            rows = rows.filter(pc.is_in(rows.column(HASH_COLUMN), value_set=pa.array(members[HASH_COLUMN].unique())))
+            _write_table(rows, self.rows_path)
+            _write_table(pa.Table.from_pandas(members, preserve_index=False), self.members_path)
+            record.update(rows=len(order), cleaned=cleaned_rows, stored=len(rows))
+
+        self.meta[name] = {
+            **(meta or {}),
+            "salt": salt,
+            "columns": [target for spec in specs for _, target, _ in spec],
+            "rows": len(order),
+            "cleaned": cleaned_rows,
+            "added": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        }
+        self._save_meta()
+        return self.meta[name]
+
+    def get(self, name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        self._check(name)
+        columns = columns or self.meta[name]["columns"]
+        hashes = self._members(name)[HASH_COLUMN].to_numpy()
+        return self._rows(hashes, columns).reindex(hashes).reset_index(drop=True).reindex(columns=columns)
+
+    def diff(self, old: str, new: str, detail: bool = False) -> pd.DataFrame:
+        """Substances added to or removed from new, and those whose hazard,
+        list or material status changed, keyed by CAS number and its
+        occurrence, which tells repeated or missing ones apart. With detail
+        every changed column is one row with its old and new value."""
+        self._check(old)
+        self._check(new)
+        with stage("release_diff", old=old, new=new) as record:
+            before, after = self._members(old), self._members(new)
+            # Substances are numbered within their CAS number in sheet order.
+            before[OCCURRENCE_COLUMN] = _occurrences(before, [CAS_COLUMN])
+            after[OCCURRENCE_COLUMN] = _occurrences(after, [CAS_COLUMN])
+            # Rows with unchanged content pair up first, what is left of a
+            # repeated or missing CAS number then pairs up in order.
+            same = [CAS_COLUMN, HASH_COLUMN]
+            before_keys, after_keys = _keyed(before, same), _keyed(after, same)
+            before, after = before[~before_keys.isin(after_keys)], after[~after_keys.isin(before_keys)]
+            # Nullable hashes survive the outer merge, float would round them.
+            before = before.assign(**{PAIR_COLUMN: _occurrences(before, [CAS_COLUMN])}).astype({HASH_COLUMN: "UInt64"})
+            after = after.assign(**{PAIR_COLUMN: _occurrences(after, [CAS_COLUMN])}).astype({HASH_COLUMN: "UInt64"})
+            merged = before.merge(after, on=[CAS_COLUMN, PAIR_COLUMN], how="outer", suffixes=("_old", "_new"), indicator=True)
+            added = merged[merged["_merge"] == "right_only"]
+            removed = merged[merged["_merge"] == "left_only"]
+            changed = merged[merged["_merge"] == "both"]
+
+            compared = [column for group in DIFF_GROUPS.values() for column in group]
+            hashes = np.concatenate([
+                added[f"{HASH_COLUMN}_new"], removed[f"{HASH_COLUMN}_old"],
+                changed[f"{HASH_COLUMN}_old"], changed[f"{HASH_COLUMN}_new"],
+            ]).astype(np.uint64)
+            rows = self._rows(hashes, [NAME_COLUMN] + compared)
+            old_rows = rows.reindex(changed[f"{HASH_COLUMN}_old"].astype(np.uint64)).reset_index(drop=True)
+            new_rows = rows.reindex(changed[f"{HASH_COLUMN}_new"].astype(np.uint64)).reset_index(drop=True)
+            cas = changed[CAS_COLUMN].reset_index(drop=True)
+            occurrence = changed[f"{OCCURRENCE_COLUMN}_new"].reset_index(drop=True)
+
+            records = []
+            for change, frame, side in (("added", added, "new"), ("removed", removed, "old")):
+                names = rows[NAME_COLUMN].reindex(frame[f"{HASH_COLUMN}_{side}"].astype(np.uint64))
+                records += [
+                    {CAS_COLUMN: value, OCCURRENCE_COLUMN: int(i), NAME_COLUMN: name, "change": change}
+                    for value, i, name in zip(frame[CAS_COLUMN], frame[f"{OCCURRENCE_COLUMN}_{side}"], names)
+                ]
+            for group, columns in DIFF_GROUPS.items():
+                for column in columns:
+                    if column not in rows.columns:
+                        continue
+                    a, b = old_rows[column], new_rows[column]
+                    if group != "hazard":
+                        # A flag column missing from one release means "not included".
+                        a, b = a.fillna(False).astype(bool), b.fillna(False).astype(bool)
+                    differs = (a != b) & ~(a.isna() & b.isna())
+                    records += [
+                        {CAS_COLUMN: cas[i], OCCURRENCE_COLUMN: int(occurrence[i]), NAME_COLUMN: new_rows[NAME_COLUMN][i], "change": "changed", "group": group, "column": column, "old": a[i], "new": b[i]}
+                        for i in np.flatnonzero(differs.to_numpy())
+                    ]
+
+            changes = pd.DataFrame(records, columns=[CAS_COLUMN, OCCURRENCE_COLUMN, NAME_COLUMN, "change", "group", "column", "old", "new"])
+            changes["change"] = pd.Categorical(changes["change"], CHANGES)
+            changes = changes.sort_values(["change", CAS_COLUMN, OCCURRENCE_COLUMN], kind="stable").reset_index(drop=True)
+            changed_rows = changes.loc[changes["change"] == "changed", [CAS_COLUMN, OCCURRENCE_COLUMN]]
+            record.update(added=len(added), removed=len(removed), compared=len(changed), changed=len(changed_rows.drop_duplicates()))
+
+        if detail:
+            return changes
+
+        summary = changes.groupby([CAS_COLUMN, OCCURRENCE_COLUMN], sort=False, observed=True, dropna=False).agg(
+            **{NAME_COLUMN: (NAME_COLUMN, "first"), "change": ("change", "first")},
+            **{group: ("group", lambda groups, group=group: (groups == group).any()) for group in DIFF_GROUPS},
+            columns=("column", lambda columns: "; ".join(columns.dropna())),
+        )
+        return summary.reset_index()
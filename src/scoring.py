@@ -0,0 +1,170 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+CAS_COLUMN = "CAS/CFSAN number"
+BATCH_SIZE = 50_000
+
+
+class Scorer:
+    """Keeps a fitted model in memory and scores feature frames in batches."""
+
+    def __init__(self, model_path: str = "model.joblib") -> None:
+        self.model = joblib.load(model_path)
+        self.features = list(self.model.feature_names_in_)
+
+    def score_frame(self, df: pd.DataFrame, batch_size: int = BATCH_SIZE) -> np.ndarray:
+        X = df[self.features].fillna(False).astype(bool)
+        scores = [self.model.predict_proba(X.iloc[i:i + batch_size])[:, 1] for i in range(0, len(X), batch_size)]
+        return np.concatenate(scores) if scores else np.empty(0)
+
+    def _iter_file(self, path: str, columns: List[str], batch_size: int) -> Iterator[pd.DataFrame]:
+        if path.endswith(".csv"):
+            yield from pd.read_csv(path, usecols=columns, chunksize=batch_size)
+            return
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+    def score_file(self, path: str, output: str, batch_size: int = BATCH_SIZE) -> int:
+        total = 0
+        header = True
+        for chunk in self._iter_file(path, [CAS_COLUMN] + self.features, batch_size):
+            scored = pd.DataFrame({CAS_COLUMN: chunk[CAS_COLUMN], "probability": self.score_frame(chunk, batch_size)})
+            scored.to_csv(output, mode="w" if header else "a", header=header, index=False)
+            header = False
+            total += len(chunk)
+        return total
+
+
+class CasScorer:
+    """Scores substances by CAS number using their features from the cleaned data."""
+
+    def __init__(self, scorer: Scorer, clean_data: pd.DataFrame, cache_size: int = 100_000) -> None:
+        self.scorer = scorer
+        data = clean_data.dropna(subset=[CAS_COLUMN]).drop_duplicates(CAS_COLUMN)
+        self.features = data.set_index(data[CAS_COLUMN].astype(str).str.strip())[scorer.features]
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Optional[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score_batch(self, cas_numbers: List[str]) -> Dict[str, Optional[float]]:
+        known = [cas for cas in cas_numbers if cas in self.features.index]
+        computed = dict(zip(known, self.scorer.score_frame(self.features.loc[known]).tolist())) if known else {}
+        scores = {cas: computed.get(cas) for cas in cas_numbers}
+
+        with self._lock:
+            for cas, score in scores.items():
+                self._cache[cas] = score
+                self._cache.move_to_end(cas)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return scores
+
+    def cached(self, cas_numbers: Iterable[str]) -> Dict[str, Optional[float]]:
+        with self._lock:
+            hits = {}
+            for cas in cas_numbers:
+                if cas in self._cache:
+                    self._cache.move_to_end(cas)
+                    hits[cas] = self._cache[cas]
+            return hits
+
+    def score(self, cas_numbers: Iterable[str]) -> pd.DataFrame:
+        cas_numbers = [str(cas).strip() for cas in cas_numbers]
+        scores = self.cached(cas_numbers)
+
+        missing = list(dict.fromkeys(cas for cas in cas_numbers if cas not in scores))
+        if missing:
+            scores.update(self.score_batch(missing))
+
+        return pd.DataFrame({
+            CAS_COLUMN: cas_numbers,
+            "found": [scores[cas] is not None for cas in cas_numbers],
+            "probability": [scores[cas] for cas in cas_numbers],
+        })
+
+
+class MicroBatcher:
+    """Collects keys from concurrent callers and scores them in one call."""
+
+    def __init__(self, score: Callable[[List[str]], Dict[str, Optional[float]]], max_batch: int = 1024, max_wait: float = 0.005) -> None:
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, key: str) -> Future:
+        future = Future()
+        self._queue.put((key, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                scores = self.score(list(dict.fromkeys(key for key, _ in batch)))
+                for key, future in batch:
+                    future.set_result(scores[key])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+def make_server(cas_scorer: CasScorer, host: str = "127.0.0.1", port: int = 8000, max_batch: int = 1024, max_wait: float = 0.005) -> ThreadingHTTPServer:
+    batcher = MicroBatcher(cas_scorer.score_batch, max_batch, max_wait)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args) -> None:
+            logging.debug(format % args)
+
+        def _respond(self, status: int, body: dict) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self) -> None:
+            if self.path != "/score":
+                self._respond(404, {"error": "not found"})
+                return
+
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                cas_numbers = [str(cas).strip() for cas in request["cas"]]
+            except (ValueError, KeyError, TypeError):
+                self._respond(400, {"error": 'expected JSON body {"cas": [...]}'})
+                return
+
+            scores = cas_scorer.cached(cas_numbers)
+            futures = {cas: batcher.submit(cas) for cas in dict.fromkeys(cas_numbers) if cas not in scores}
+            scores.update({cas: future.result() for cas, future in futures.items()})
+
+            self._respond(200, {"results": [{"cas": cas, "found": scores[cas] is not None, "probability": scores[cas]} for cas in cas_numbers]})
+
+    return ThreadingHTTPServer((host, port), Handler)
@@ -0,0 +1,33 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.cleaning import LIST_FLAGS
+
+TOTAL = "Total"
+STATUS_FLAGS = ["Hazardous auth", "Potential concern non-auth", "food_contact"]
+COOCCURRENCE_FLAGS = STATUS_FLAGS + LIST_FLAGS
+
+
+def _flag_matrix(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    return df[columns].fillna(False).to_numpy(dtype=np.float64)
+
+
+def cooccurrence_matrix(df: pd.DataFrame, rows: List[str], columns: Optional[List[str]] = None, total: bool = False) -> pd.DataFrame:
+    # Entry (i, j) counts substances flagged with both rows[i] and columns[j].
+    columns = rows if columns is None else columns
+    left = _flag_matrix(df, rows)
+    right = _flag_matrix(df, columns)
+
+    counts = left.T @ right
+    if total:
+        counts = np.column_stack([left.sum(axis=0), counts])
+        columns = [TOTAL] + list(columns)
+
+    return pd.DataFrame(counts.astype(np.int64), index=rows, columns=columns)
+
+
+def material_cooccurrence(df: pd.DataFrame, materials: List[str], flags: Optional[List[str]] = None) -> pd.DataFrame:
+    flags = COOCCURRENCE_FLAGS if flags is None else flags
+    return cooccurrence_matrix(df, materials, [flag for flag in flags if flag in df.columns], total=True)
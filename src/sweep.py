@@ -0,0 +1,88 @@
+from itertools import product
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+
+from src.cleaning import LIST_FLAGS, MATERIALS, SOURCE_PATTERN
+
+TARGETS = ["food_contact", "Hazardous auth", "Potential concern non-auth"]
+PARAM_GRID = {
+    "C": [0.1, 1.0, 10.0],
+    "class_weight": [None, "balanced"],
+}
+METRICS = ["accuracy", "precision", "recall", "f1", "roc_auc"]
+
+
+def feature_sets(columns: List[str]) -> Dict[str, List[str]]:
+    return {
+        "materials": [column for column in MATERIALS if column in columns],
+        "sources": [column for column in columns if SOURCE_PATTERN.match(column)],
+        "lists": [column for column in LIST_FLAGS if column in columns],
+    }
+
+
+def _param_combinations(param_grid: Dict[str, list]) -> List[dict]:
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in product(*(param_grid[name] for name in names))]
+
+
+def _fit_fold(X: sparse.csr_matrix, y: np.ndarray, train: np.ndarray, test: np.ndarray, params: dict) -> Dict[str, float]:
+    clf = LogisticRegression(max_iter=1000, **params)
+    clf.fit(X[train], y[train])
+
+    y_pred = clf.predict(X[test])
+    y_prob = clf.predict_proba(X[test])[:, 1]
+    return {
+        "accuracy": accuracy_score(y[test], y_pred),
+        "precision": precision_score(y[test], y_pred, zero_division=0),
+        "recall": recall_score(y[test], y_pred, zero_division=0),
+        "f1": f1_score(y[test], y_pred, zero_division=0),
+        "roc_auc": roc_auc_score(y[test], y_prob) if len(np.unique(y[test])) > 1 else np.nan,
+    }
+
+
+def run_sweep(
+    df: pd.DataFrame,
+    targets: Optional[List[str]] = None,
+    features: Optional[Dict[str, List[str]]] = None,
+    param_grid: Optional[Dict[str, list]] = None,
+    folds: int = 5,
+    jobs: int = 1,
+    random_state: int = 42,
+) -> pd.DataFrame:
+    targets = targets or TARGETS
+    features = features or feature_sets(list(df.columns))
+    combinations = _param_combinations(param_grid or PARAM_GRID)
+
+    matrices = {
+        name: sparse.csr_matrix(df[columns].fillna(False).to_numpy(dtype=np.float64))
+        for name, columns in features.items() if columns
+    }
+
+    tasks = []
+    for target in targets:
+        y = df[target].fillna(False).to_numpy(dtype=bool)
+        splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=random_state).split(np.zeros(len(y)), y))
+        for feature_set, X in matrices.items():
+            for params in combinations:
+                for fold, (train, test) in enumerate(splits):
+                    tasks.append(((target, feature_set, params, fold), (X, y, train, test, params)))
+
+    scores = Parallel(n_jobs=jobs)(delayed(_fit_fold)(*args) for _, args in tasks)
+
+    rows = []
+    for (target, feature_set, params, fold), score in zip((key for key, _ in tasks), scores):
+        rows.append({"target": target, "features": feature_set, **{name: str(value) for name, value in params.items()}, "fold": fold, **score})
+
+    results = pd.DataFrame(rows)
+    keys = ["target", "features"] + list(param_grid or PARAM_GRID)
+    summary = results.groupby(keys, sort=False)[METRICS].agg(["mean", "std"])
+    summary.columns = [f"{metric}_{stat}" for metric, stat in summary.columns]
+    summary["n_features"] = [matrices[feature_set].shape[1] for feature_set in summary.index.get_level_values("features")]
+    return summary.reset_index().sort_values(["target", "roc_auc_mean"], ascending=[True, False], kind="stable")
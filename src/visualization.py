@@ -1,38 +1,33 @@
-from typing import Tuple
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 
 import pandas as pd
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import numpy as np
 import seaborn as sns
 from sklearn.metrics import confusion_matrix, roc_curve, auc
-from sklearn.linear_model import LogisticRegression
-
-MATERIALS = [
-    "Plastics",
-    "Coatings",
-    "Rubber",
-    "Silicones",
-    "Ion-Exchange Resins",
-    "Paper/Board",
-    "Cellophane",
-    "Textiles",
-    "Cork and Wood",
-    "Adhesives",
-    "Colorants",
-    "Printing Inks",
-    "Wax",
-    "Inorganics",
-    "A&I Materials",
-    "Other Uses",
-]
-
-def prepare_data_for_material_plots(df: pd.DataFrame) -> pd.DataFrame:
+
+from src.cleaning import MATERIALS
+from src.hashing import file_checksum, frame_checksum, text_checksum
+from src.profiling import cache, stage
+from src.stats import STATUS_FLAGS, TOTAL, cooccurrence_matrix, material_cooccurrence
+
+PLOT_COLUMNS = MATERIALS + ["Hazardous auth", "Potential concern non-auth", "food_contact"]
+
+def prepare_data_for_material_plots(df: pd.DataFrame, cooccurrence: pd.DataFrame = None) -> pd.DataFrame:
+    if cooccurrence is None:
+        with stage("material_cooccurrence", rows=len(df)):
+            cooccurrence = material_cooccurrence(df, MATERIALS, ["Hazardous auth"])
+
     results = []
 
     for column in MATERIALS:
-        total_substances = df[column].sum()
-        hazardous_substances = len(df[df["Hazardous auth"] & df[column]])
+        total_substances = cooccurrence.at[column, TOTAL]
+        hazardous_substances = cooccurrence.at[column, "Hazardous auth"]
 
         percentage_hazardous = round((hazardous_substances / total_substances) * 100, 1)
         results.append(
@@ -63,16 +58,18 @@ def _plot_bars(labels: pd.Series, values: pd.Series, color: str="#000080", is_pe
             fontsize=8,
         )
 
-def plot_hazardous_pie_chart(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (12, 8)):
+def plot_hazardous_pie_chart(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (12, 8), path: str = "pie_chart_of_percentage_of_hazardous_substances_in_contact_with_food.png"):
     plt.style.use("dark_background")
 
     fig = plt.figure(figsize=fig_size)
     gs = gridspec.GridSpec(2, 2, width_ratios=[2, 1], height_ratios=[1, 1])
 
+    status = cooccurrence_matrix(df, STATUS_FLAGS)
+
     total_count = len(df)
-    potential_concern_count = len(df[df["Potential concern non-auth"] & (~df["Hazardous auth"])])
-    hazardous_count = len(df[df["Hazardous auth"]])
-    hsub_in_food = len(df[df["Hazardous auth"] & df["food_contact"]])
+    potential_concern_count = status.at["Potential concern non-auth", "Potential concern non-auth"] - status.at["Potential concern non-auth", "Hazardous auth"]
+    hazardous_count = status.at["Hazardous auth", "Hazardous auth"]
+    hsub_in_food = status.at["Hazardous auth", "food_contact"]
     hsub_no_food = hazardous_count - hsub_in_food
 
     chart_data = [hsub_in_food, hsub_no_food]
@@ -102,18 +99,19 @@ def plot_hazardous_pie_chart(df: pd.DataFrame, save: bool = False, fig_size: Tup
 
     plt.tight_layout()
     if save:
-        plt.savefig("pie_chart_of_percentage_of_hazardous_substances_in_contact_with_food.png")
+        plt.savefig(path)
+        plt.close()
         return
 
     plt.show(block=False)
     plt.pause(0.2)
 
 
-def plot_hazardous_count(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (11, 6)) -> bool:
+def plot_hazardous_count(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (11, 6), path: str = "hazardous_substances_count_in_materials.png") -> bool:
     plt.style.use("dark_background")
     plt.figure(figsize=fig_size)
 
-    df.sort_values("hazardous_substances_count", inplace=True, ascending=False)
+    df = df.sort_values("hazardous_substances_count", ascending=False)
     
     _plot_bars(df["material"], df["hazardous_substances_count"])
     
@@ -121,17 +119,18 @@ def plot_hazardous_count(df: pd.DataFrame, save: bool = False, fig_size: Tuple[f
     plt.tight_layout()
 
     if save:
-        plt.savefig("hazardous_substances_count_in_materials.png")
+        plt.savefig(path)
+        plt.close()
         return
 
     plt.show(block=False)
     plt.pause(0.2)
 
-def plot_hazardous_percentage(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (11, 6)) -> None:
+def plot_hazardous_percentage(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (11, 6), path: str = "percentage_of_hazardous_substances_in_materials.png") -> None:
     plt.style.use("dark_background")
     plt.figure(figsize=fig_size)
 
-    df.sort_values("percentage_hazardous", inplace=True, ascending=False)
+    df = df.sort_values("percentage_hazardous", ascending=False)
 
     _plot_bars(df["material"], df["percentage_hazardous"], is_perc=True)
     
@@ -139,18 +138,19 @@ def plot_hazardous_percentage(df: pd.DataFrame, save: bool = False, fig_size: Tu
     plt.tight_layout()
     
     if save:
-        plt.savefig("percentage_of_hazardous_substances_in_materials.png")
+        plt.savefig(path)
+        plt.close()
         return
 
     plt.show(block=False)
     plt.pause(0.2)
 
 
-def plot_material_count(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (11, 6)) -> None:
+def plot_material_count(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (11, 6), path: str = "substances_count_in_materials.png") -> None:
     plt.style.use("dark_background")
     plt.figure(figsize=fig_size)
 
-    df.sort_values("count", inplace=True, ascending=False)
+    df = df.sort_values("count", ascending=False)
     
     _plot_bars(df["material"], df["count"])
     
@@ -158,11 +158,154 @@ def plot_material_count(df: pd.DataFrame, save: bool = False, fig_size: Tuple[fl
     plt.tight_layout()
 
     if save:
-        plt.savefig("substances_count_in_materials.png")
+        plt.savefig(path)
+        plt.close()
+        return
+
+    plt.show(block=False)
+    plt.pause(0.2)
+
+
+def plot_confusion_matrix(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (8, 6), path: str = "confiusion_matrix.png") -> None:
+    cm = confusion_matrix(df["y_true"], df["y_pred"])
+    plt.figure(figsize=fig_size)
+    sns.heatmap(cm, annot=True, fmt='g', cmap='Blues', cbar=False)
+    plt.xlabel('Predicted labels')
+    plt.ylabel('True labels')
+    plt.title('Confusion Matrix')
+
+    if save:
+        plt.savefig(path)
+        plt.close()
+        return
+
+    plt.show(block=False)
+    plt.pause(0.2)
+
+
+def plot_ROC(df: pd.DataFrame, save: bool = False, fig_size: Tuple[float, float] = (8, 6), path: str = "ROC.png") -> None:
+    fpr, tpr, _ = roc_curve(df["y_true"], df["y_prob"])
+    roc_auc = auc(fpr, tpr)
+
+    plt.figure(figsize=fig_size)
+    plt.plot(fpr, tpr, color='darkorange', label=f'ROC curve (area = {roc_auc:.2f})')
+    plt.plot([0, 1], [0, 1], color='navy', linestyle='--')
+    plt.xlabel('False Positive Rate')
+    plt.ylabel('True Positive Rate')
+    plt.title('Receiver Operating Characteristic (ROC) Curve')
+    plt.legend(loc='lower right')
+
+    if save:
+        plt.savefig(path)
+        plt.close()
         return
 
     plt.show(block=False)
     plt.pause(0.2)
 
 
+PLOTS = {
+    "material_count": plot_material_count,
+    "hazardous_count": plot_hazardous_count,
+    "hazardous_percentage": plot_hazardous_percentage,
+    "hazardous_pie_chart": plot_hazardous_pie_chart,
+    "confusion_matrix": plot_confusion_matrix,
+    "ROC": plot_ROC,
+}
+
+# (plot name, data, output path, extra keyword arguments)
+FigureJob = Tuple[str, pd.DataFrame, str, dict]
+
+MATERIAL_FIGURES = {
+    "material_count": "substances_count_in_materials.png",
+    "hazardous_count": "hazardous_substances_count_in_materials.png",
+    "hazardous_percentage": "percentage_of_hazardous_substances_in_materials.png",
+    "hazardous_pie_chart": "pie_chart_of_percentage_of_hazardous_substances_in_contact_with_food.png",
+}
+REGRESSION_FIGURES = {
+    "confusion_matrix": "confiusion_matrix.png",
+    "ROC": "ROC.png",
+}
+
+
+def material_figure_jobs(df: pd.DataFrame, material_data: pd.DataFrame) -> List[FigureJob]:
+    return [
+        ("material_count", material_data, MATERIAL_FIGURES["material_count"], {}),
+        ("hazardous_count", material_data, MATERIAL_FIGURES["hazardous_count"], {}),
+        ("hazardous_percentage", material_data, MATERIAL_FIGURES["hazardous_percentage"], {}),
+        ("hazardous_pie_chart", df[STATUS_FLAGS], MATERIAL_FIGURES["hazardous_pie_chart"], {}),
+    ]
+
+
+def regression_figure_jobs(y_true: pd.Series, y_pred: np.ndarray, y_prob: np.ndarray) -> List[FigureJob]:
+    results = pd.DataFrame({"y_true": np.asarray(y_true), "y_pred": y_pred, "y_prob": y_prob})
+    return [
+        ("confusion_matrix", results[["y_true", "y_pred"]], REGRESSION_FIGURES["confusion_matrix"], {}),
+        ("ROC", results[["y_true", "y_prob"]], REGRESSION_FIGURES["ROC"], {}),
+    ]
+
+
+def _figure_key(job: FigureJob) -> str:
+    # The plotting code is part of the key, so a code change redraws figures.
+    name, data, path, kwargs = job
+    return text_checksum(name, frame_checksum(data), os.path.basename(path), json.dumps(kwargs, sort_keys=True, default=str), file_checksum(__file__))
+
+
+def _init_renderer() -> None:
+    matplotlib.use("Agg")
+
+
+def _render(job: FigureJob) -> str:
+    name, data, path, kwargs = job
+    with stage("render_figure", figure=name, rows=len(data)):
+        PLOTS[name](data.copy(), save=True, path=path, **kwargs)
+    return path
+
+
+def _entry_path(cache_folder: str, path: str) -> str:
+    return os.path.join(cache_folder, f"{text_checksum(path)[:16]}.key")
+
+
+def _read_entry(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _write_entry(path: str, key: str) -> None:
+    # The model and plots stages render side by side with run -j, so every
+    # figure has its own entry and each is replaced in one step.
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(key)
+    os.replace(temp_path, path)
+
+
+def render_figures(jobs: List[FigureJob], cache_folder: Optional[str] = None, processes: int = 1) -> List[str]:
+    """Saves every figure with the Agg backend, skipping ones whose data,
+    parameters, plotting code and output file are unchanged since the last render."""
+    keys = {job[2]: _figure_key(job) for job in jobs}
+    stale = [job for job in jobs if not os.path.exists(job[2]) or not cache_folder or _read_entry(_entry_path(cache_folder, job[2])) != keys[job[2]]]
+    for job in jobs:
+        cache("figures", job not in stale)
+
+    with stage("render_figures", figures=len(jobs), stale=len(stale), processes=processes):
+        if processes > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_renderer) as executor:
+                rendered = list(executor.map(_render, stale))
+        else:
+            backend = matplotlib.get_backend()
+            plt.switch_backend("Agg")
+            try:
+                rendered = [_render(job) for job in stale]
+            finally:
+                plt.switch_backend(backend)
+
+    if cache_folder:
+        os.makedirs(cache_folder, exist_ok=True)
+        for path in rendered:
+            _write_entry(_entry_path(cache_folder, path), keys[path])
+
+    return rendered
 
@@ -1,67 +1,370 @@
 import argparse
 import os
 
-import matplotlib.pyplot as plt
+# Commands import their dependencies (pandas, sklearn, matplotlib, ...) when
+# they run, so `--help` and light commands start without loading the stack.
 
-from src.ffc_db import FFC_DB
-from src.visualization import prepare_data_for_material_plots, plot_hazardous_count, plot_hazardous_percentage, plot_hazardous_pie_chart, plot_material_count
+CORRELATION_METHODS = ("pearson", "kendall", "spearman")
+
+
+def load_db(args: argparse.Namespace):
+    from src.ffc_db import FFC_DB
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="Script to manage FFCdb data.")
-
-    parser.add_argument("-cm", "--corr-method", default="pearson", help="Checks pandas correlation between all numeric columns in cleaned data('pearson', 'kendall', 'spearman').")
-    parser.add_argument("-corr", "--correlation", action="store_true", help="Saves pandas correlation between all numeric columns in cleaned data to csv file.")
-    parser.add_argument("-c", "--config", default="constants.toml", help="Saves pandas correlation between all numeric columns in cleaned data to csv file.")
-    parser.add_argument("-fd", "--force-download", action="store_true", help="Force redownload of raw data")
-    parser.add_argument("-fc", "--force-cleanup", action="store_true", help="Force recleanup of raw data")
-    parser.add_argument("-v", "--visualisation", action="store_true", help="Shows graphs from presentations")
-    parser.add_argument("-sv", "--save-visualisation", action="store_true", help="Saves graphs from presentations to png files")
-    
-    parser.add_argument("-r", "--regression", action="store_true", help="Runs logistic regression.")
-    parser.add_argument("-sr", "--save-regression", action="store_true", help="Runs logistic regression and saves model and graphs of model.")
-
-
-    args = parser.parse_args()
-    
-    if args.corr_method not in ('pearson', 'kendall', 'spearman'):
-        raise Exception("Correlation method should be one of these values: ('pearson', 'kendall', 'spearman').")
-    
     if args.config and not os.path.exists(args.config):
         print(args.config)
         raise Exception("Custom config file doesn't exist.")
-    
-    db = FFC_DB(config=args.config)
-
-    if not db.is_downloaded or args.force_download:
-        db.download_xlsx()
-    
-    if not db.is_cleaned or args.force_cleanup:
-        db.clean_data()
-    
-    df = db.get_clean_data()
-
-    if args.correlation:
-       db.save_correlations(df, method=args.corr_method) 
-
-    material_data = prepare_data_for_material_plots(df)
-
-    if args.save_visualisation:
-        plot_material_count(material_data, save=True)    
-        plot_hazardous_count(material_data, save=True)    
-        plot_hazardous_percentage(material_data, save=True)    
-        plot_hazardous_pie_chart(df, save=True)
-
-    if args.visualisation:
-        plot_material_count(material_data)    
-        plot_hazardous_count(material_data)    
-        plot_hazardous_percentage(material_data)    
-        plot_hazardous_pie_chart(df)
-    
-    if args.regression or args.save_regression:
-        db.run_regression(df, args.save_regression)
-
-        
-    input("Press enter to close script.")
+
+    return FFC_DB(config=args.config)
+
+
+def prepare_db(args: argparse.Namespace, stages: tuple = ("clean",), params: dict = None, force: tuple = ()):
+    from src.pipeline import Pipeline
+
+    db = load_db(args)
+    Pipeline(db).run(stages, params, force, jobs=args.jobs)
+    return db
+
+
+def download(args: argparse.Namespace) -> bool:
+    prepare_db(args, ("download",), force=("download",) if args.force else ())
+    return False
+
+
+def clean(args: argparse.Namespace) -> bool:
+    force = ("download",) * args.force_download + ("clean",) * args.force
+    db = prepare_db(args, force=force)
+
+    if args.export_csv:
+        db.export_clean_data(args.export_csv)
+
+    return False
+
+
+def corr(args: argparse.Namespace) -> bool:
+    prepare_db(args, ("correlations",), {"method": args.method, "top_k": args.top_k, "threshold": args.threshold})
+    return False
+
+
+def plot(args: argparse.Namespace) -> bool:
+    if args.save:
+        prepare_db(args, ("plots",))
+        return False
+
+    from src.ffc_db import MATERIALS
+    from src.stats import material_cooccurrence
+    from src.visualization import PLOT_COLUMNS, prepare_data_for_material_plots, plot_hazardous_count, plot_hazardous_percentage, plot_hazardous_pie_chart, plot_material_count
+
+    db = prepare_db(args, ("features",))
+    df = db.get_features(PLOT_COLUMNS)
+    material_data = prepare_data_for_material_plots(df, material_cooccurrence(df, MATERIALS))
+
+    plot_material_count(material_data)
+    plot_hazardous_count(material_data)
+    plot_hazardous_percentage(material_data)
+    plot_hazardous_pie_chart(df)
+    return True
+
+
+def train(args: argparse.Namespace) -> bool:
+    if args.sweep:
+        import pandas as pd
+
+        from src.ffc_db import SWEEP_FILE
+
+        prepare_db(args, ("sweep",), {"folds": args.folds})
+        print(pd.read_csv(SWEEP_FILE, keep_default_na=False).to_string(index=False))
+        return False
+
+    if args.save:
+        prepare_db(args, ("model",))
+        return False
+
+    from src.ffc_db import REGRESSION_COLUMNS
+
+    db = prepare_db(args, ("features",))
+    db.run_regression(db.get_features(REGRESSION_COLUMNS), jobs=args.jobs)
+    return True
+
+
+def run(args: argparse.Namespace) -> bool:
+    from src.pipeline import ANALYSIS_STAGES
+
+    prepare_db(args, tuple(args.stages or ANALYSIS_STAGES), {"method": args.method, "folds": args.folds}, tuple(args.force))
+    return False
+
+
+def score(args: argparse.Namespace) -> bool:
+    from src.scoring import CAS_COLUMN, CasScorer, Scorer, make_server
+
+    if args.file:
+        count = Scorer(args.model).score_file(args.file, args.output)
+        print(f"Scored {count} substances to {args.output}")
+
+    if args.cas or args.serve:
+        db = prepare_db(args)
+        scorer = Scorer(args.model)
+        cas_scorer = CasScorer(scorer, db.get_clean_data([CAS_COLUMN] + scorer.features, compact=True))
+
+        if args.cas:
+            with open(args.cas, "r") as f:
+                cas_numbers = [line.strip() for line in f if line.strip()]
+            cas_scorer.score(cas_numbers).to_csv(args.output, index=False)
+            print(f"Scored {len(cas_numbers)} CAS numbers to {args.output}")
+
+        if args.serve:
+            server = make_server(cas_scorer, port=args.serve)
+            print(f"Serving scores on http://127.0.0.1:{args.serve}/score")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.server_close()
+
+    return False
+
+
+def query(args: argparse.Namespace) -> bool:
+    from src.cleaning import LIST_FLAGS, MATERIALS
+    from src.stats import COOCCURRENCE_FLAGS, material_cooccurrence
+
+    db = prepare_db(args)
+
+    if args.expression or args.at_least is not None:
+        index = db.get_bitmap_index()
+
+        if args.expression:
+            rows = index.rows(args.expression)
+            print(f"{len(rows)} substances match: {args.expression}")
+
+            if args.output:
+                db.get_clean_data(["CAS/CFSAN number", "Name"]).iloc[rows].to_csv(args.output, index=False)
+
+        if args.at_least is not None:
+            print(f"{index.count_at_least(args.at_least, LIST_FLAGS)} substances are included in at least {args.at_least} lists")
+
+    if args.cooccurrence:
+        df = db.get_clean_data(list(dict.fromkeys(MATERIALS + COOCCURRENCE_FLAGS)))
+        material_cooccurrence(df, MATERIALS).to_csv("material_cooccurrence.csv", index_label="material")
+
+    return False
+
+
+def lookup(args: argparse.Namespace) -> bool:
+    queries = list(args.queries)
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            queries += [line.strip() for line in f if line.strip()]
+    if not queries:
+        raise Exception("Nothing to look up, pass names or CAS numbers or --file.")
+
+    db = prepare_db(args)
+    matches = db.get_lookup_index().lookup_many(queries, args.limit, args.min_score)
+
+    if args.output:
+        matches.to_csv(args.output, index=False)
+        print(f"Matched {matches.dropna(subset=['row'])['query'].nunique()} of {len(set(queries))} queries to {args.output}")
+    else:
+        print(matches.drop(columns="row").to_string(index=False))
+
+    return False
+
+
+def sql(args: argparse.Namespace) -> bool:
+    import sqlite3
+
+    import pandas as pd
+
+    db = prepare_db(args, ("sqlite",), force=("sqlite",) if args.force else ())
+    if not args.query:
+        print(f"SQLite database: {db.sqlite_path}")
+        return False
+
+    with sqlite3.connect(db.sqlite_path) as connection:
+        result = pd.read_sql_query(args.query, connection)
+
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"Saved {len(result)} rows to {args.output}")
+    else:
+        print(result.to_string(index=False))
+
+    return False
+
+
+def releases(args: argparse.Namespace) -> bool:
+    db = load_db(args)
+
+    if args.add:
+        name = args.name or os.path.splitext(os.path.basename(args.add))[0]
+        meta = db.add_release(args.add, name, jobs=args.jobs)
+        print(f"Stored {name}: {meta['rows']} rows, {meta['cleaned']} cleaned")
+
+    if args.update is not None:
+        added = db.update_releases(args.update or None, args.jobs)
+        print(f"Updated releases: {', '.join(added) if added else 'none, all up to date'}")
+
+    store = db.get_release_store()
+    for name in store.releases:
+        meta = store.meta[name]
+        print(f"{name:<20} published={meta.get('published') or '-':<12} rows={meta['rows']:<8} cleaned={meta['cleaned']}")
+
+    return False
+
+
+def diff(args: argparse.Namespace) -> bool:
+    db = load_db(args)
+    stored = db.get_release_store().releases
+    if len(stored) < 2 and not (args.old and args.new):
+        raise Exception("Diff needs two stored releases, add them with `releases --update` or `releases --add`.")
+
+    old = args.old or stored[-2]
+    new = args.new or stored[-1]
+    changes = db.diff_releases(old, new, args.detail)
+
+    substances = changes.drop_duplicates(["CAS/CFSAN number", "occurrence"])
+    counts = substances["change"].value_counts()
+    print(f"{old} -> {new}: {counts['added']} added, {counts['removed']} removed, {counts['changed']} changed")
+    if not args.detail:
+        print(", ".join(f"{group}: {changes[group].sum()}" for group in ("hazard", "list", "material")))
+
+    if args.output:
+        changes.to_csv(args.output, index=False)
+    else:
+        print(changes.head(args.top).to_string(index=False))
+
+    return False
+
+
+def memory(args: argparse.Namespace) -> bool:
+    db = prepare_db(args)
+    report = db.memory_report()
+
+    total = report.iloc[-1]
+    print(f"Cleaned data: {total['bytes'] / 2**20:.1f} MB, compact: {total['compact_bytes'] / 2**20:.1f} MB ({total['ratio']:.0%})")
+    print(report.head(args.top).to_string(index=False))
+
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+    return False
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Script to manage FFCdb data. Without a command raw data is downloaded and cleaned if missing.")
+    parser.add_argument("-c", "--config", default="constants.toml", help="Path to config file.")
+    parser.add_argument("-b", "--batch", action="store_true", help="Non-interactive mode, never waits for enter before closing (for scheduled jobs).")
+    parser.add_argument("-p", "--profile", action="store_true", help="Logs time, peak memory, processed rows and columns of every stage and cache hit/miss counters as JSON lines.")
+    parser.add_argument("-po", "--profile-output", default=None, help="Writes --profile JSON lines to given file instead of stderr.")
+    parser.add_argument("-pnm", "--profile-no-memory", action="store_true", help="Skips tracemalloc with --profile, which slows allocation heavy stages several times.")
+    parser.add_argument("-cp", "--cprofile", default=None, metavar="STAGE", help="With --profile also dumps cProfile stats of given stage (e.g. clean, transform, correlations, fit) to --cprofile-dir.")
+    parser.add_argument("-cpd", "--cprofile-dir", default="profiles", help="Folder for --cprofile stats.")
+    parser.set_defaults(command=clean, force=False, force_download=False, jobs=1, export_csv=None)
+
+    jobs = argparse.ArgumentParser(add_help=False)
+    jobs.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes.")
+
+    commands = parser.add_subparsers(title="commands")
+
+    parser_download = commands.add_parser("download", help="Downloads raw data.")
+    parser_download.add_argument("-f", "--force", action="store_true", help="Force redownload of raw data")
+    parser_download.set_defaults(command=download)
+
+    parser_clean = commands.add_parser("clean", parents=[jobs], help="Downloads raw data if missing and cleans it.")
+    parser_clean.add_argument("-f", "--force", action="store_true", help="Force recleanup of raw data")
+    parser_clean.add_argument("-fd", "--force-download", action="store_true", help="Force redownload of raw data")
+    parser_clean.add_argument("-csv", "--export-csv", default=None, help="Exports cleaned data to given csv file.")
+    parser_clean.set_defaults(command=clean)
+
+    parser_corr = commands.add_parser("corr", parents=[jobs], help="Saves correlation between all numeric columns in cleaned data to csv file.")
+    parser_corr.add_argument("-m", "--method", default="pearson", choices=CORRELATION_METHODS, help="Correlation method.")
+    parser_corr.add_argument("-k", "--top-k", type=int, default=None, help="Saves only the given number of most correlated column pairs instead of the full matrix.")
+    parser_corr.add_argument("-t", "--threshold", type=float, default=None, help="Saves only column pairs with absolute correlation of at least given value instead of the full matrix.")
+    parser_corr.set_defaults(command=corr)
+
+    parser_plot = commands.add_parser("plot", parents=[jobs], help="Shows graphs from presentations.")
+    parser_plot.add_argument("-s", "--save", action="store_true", help="Saves graphs to png files instead of showing them.")
+    parser_plot.set_defaults(command=plot)
+
+    parser_train = commands.add_parser("train", parents=[jobs], help="Runs logistic regression.")
+    parser_train.add_argument("-s", "--save", action="store_true", help="Saves model and graphs of model.")
+    parser_train.add_argument("-sw", "--sweep", action="store_true", help="Cross-validates logistic regression for every target, feature set and hyperparameters and saves metrics to csv file.")
+    parser_train.add_argument("-k", "--folds", type=int, default=5, help="Number of cross-validation folds used by --sweep.")
+    parser_train.set_defaults(command=train)
+
+    parser_run = commands.add_parser("run", parents=[jobs], help="Runs pipeline stages whose inputs, config or code changed, independent stages side by side.")
+    parser_run.add_argument("stages", nargs="*", help="Stages to bring up to date: download, raw, clean, sqlite, features, correlations, model, sweep, plots (default: correlations, model and plots).")
+    parser_run.add_argument("-f", "--force", action="append", default=[], metavar="STAGE", help="Reruns given stage even if it is up to date, can be repeated.")
+    parser_run.add_argument("-m", "--method", default="pearson", choices=CORRELATION_METHODS, help="Correlation method.")
+    parser_run.add_argument("-k", "--folds", type=int, default=5, help="Number of cross-validation folds used by sweep stage.")
+    parser_run.set_defaults(command=run)
+
+    parser_score = commands.add_parser("score", parents=[jobs], help="Scores substances with a saved model.")
+    parser_score.add_argument("-m", "--model", default="model.joblib", help="Model saved by `train --save`.")
+    parser_score.add_argument("--cas", default=None, help="Scores CAS numbers listed one per line in given file.")
+    parser_score.add_argument("--file", default=None, help="Scores every substance in given cleaned data file (parquet or csv).")
+    parser_score.add_argument("-o", "--output", default="scores.csv", help="Csv file for --cas and --file results.")
+    parser_score.add_argument("--serve", type=int, default=None, metavar="PORT", help="Serves POST /score {\"cas\": [...]} on given local port with model kept in memory.")
+    parser_score.set_defaults(command=score)
+
+    parser_query = commands.add_parser("query", parents=[jobs], help="Counts substances matching flag expressions.")
+    parser_query.add_argument("expression", nargs="?", default=None, help="Flag expression, e.g. \"Plastics & SVHC REACH & ~TSCA\".")
+    parser_query.add_argument("-o", "--output", default=None, help="Saves CAS numbers and names of matching substances to csv file.")
+    parser_query.add_argument("-al", "--at-least", type=int, default=None, help="Counts substances included in at least given number of regulatory lists.")
+    parser_query.add_argument("-co", "--cooccurrence", action="store_true", help="Saves counts of substances shared by every material and hazard/list flag to csv file.")
+    parser_query.set_defaults(command=query)
+
+    parser_lookup = commands.add_parser("lookup", parents=[jobs], help="Finds substances by CAS/CFSAN number, name or synonym, tolerating typos in names.")
+    parser_lookup.add_argument("queries", nargs="*", help="CAS numbers or names to look up.")
+    parser_lookup.add_argument("-f", "--file", default=None, help="Looks up every line of given file, e.g. a supplier ingredient list.")
+    parser_lookup.add_argument("-n", "--limit", type=int, default=1, help="Number of matches per query.")
+    parser_lookup.add_argument("-ms", "--min-score", type=float, default=0.5, help="Lowest trigram similarity (0-1) of a fuzzy name match.")
+    parser_lookup.add_argument("-o", "--output", default=None, help="Saves matches to csv file instead of printing them.")
+    parser_lookup.set_defaults(command=lookup)
+
+    parser_sql = commands.add_parser("sql", parents=[jobs], help="Exports cleaned data and parsed \"+ why\" detail to an indexed SQLite database and runs queries on it.")
+    parser_sql.add_argument("query", nargs="?", default=None, help="SQL query, e.g. \"SELECT list, count(*) FROM lists GROUP BY list\", without one only the export runs.")
+    parser_sql.add_argument("-f", "--force", action="store_true", help="Rebuilds the database even if it is up to date.")
+    parser_sql.add_argument("-o", "--output", default=None, help="Saves query result to csv file instead of printing it.")
+    parser_sql.set_defaults(command=sql)
+
+    parser_releases = commands.add_parser("releases", parents=[jobs], help="Stores FFCdb releases side by side, only cleaning rows that changed, and lists stored releases.")
+    parser_releases.add_argument("-u", "--update", nargs="*", default=None, metavar="NAME", help="Downloads and stores new or changed releases of api_record_url, all or only given ones.")
+    parser_releases.add_argument("-a", "--add", default=None, metavar="PATH", help="Stores a local FFCdb workbook as a release.")
+    parser_releases.add_argument("-n", "--name", default=None, help="Release name for --add (default: file name).")
+    parser_releases.set_defaults(command=releases)
+
+    parser_diff = commands.add_parser("diff", help="Lists substances added, removed or with changed hazard, list or material status between two stored releases.")
+    parser_diff.add_argument("old", nargs="?", default=None, help="Older release (default: second newest).")
+    parser_diff.add_argument("new", nargs="?", default=None, help="Newer release (default: newest).")
+    parser_diff.add_argument("-d", "--detail", action="store_true", help="One row per changed column with old and new value.")
+    parser_diff.add_argument("-n", "--top", type=int, default=50, help="Number of rows to print without --output.")
+    parser_diff.add_argument("-o", "--output", default=None, help="Saves all changes to csv file.")
+    parser_diff.set_defaults(command=diff)
+
+    parser_memory = commands.add_parser("memory", parents=[jobs], help="Compares memory of cleaned data as loaded and in compact mode, per column.")
+    parser_memory.add_argument("-n", "--top", type=int, default=20, help="Number of largest columns to print.")
+    parser_memory.add_argument("-o", "--output", default=None, help="Saves report of every column to csv file.")
+    parser_memory.set_defaults(command=memory)
+
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+
+    if args.profile:
+        from src import profiling
+
+        profiling.enable(args.profile_output, not args.profile_no_memory, args.cprofile, args.cprofile_dir)
+
+    try:
+        interactive = args.command(args)
+    finally:
+        if args.profile:
+            profiling.METRICS.report()
+
+    if interactive and not args.batch:
+        input("Press enter to close script.")
+
+
 if __name__ == "__main__":
     main()
-
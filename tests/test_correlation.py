@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.correlation import METHODS, correlation_matrix
+
+
+def sparse_frame(rows: int = 2000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    score = rng.random(rows) * 3.7
+    score[rng.random(rows) < 0.8] = np.nan
+    other = rng.random(rows)
+    other[::7] = np.nan
+    return pd.DataFrame({
+        "score": score,
+        # Only set where score is missing, so constant over the shared rows.
+        "flag": np.where(np.isnan(score) & (rng.random(rows) < 0.05), 1.0, 0.0),
+        "other": other,
+        "binary": (rng.random(rows) < 0.3).astype(np.float64),
+        "constant": np.full(rows, 0.1),
+    })
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_matches_pandas(method):
+    df = sparse_frame()
+    expected = df.corr(method=method)
+    np.testing.assert_allclose(correlation_matrix(df, method), expected, atol=1e-10)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_constant_over_shared_rows(method):
+    df = pd.DataFrame({"a": [0.3, 0.3, 0.3, np.nan, 1.0], "b": [1.0, 2.0, 4.0, 5.0, np.nan]})
+    assert np.isnan(correlation_matrix(df, method).loc["a", "b"])
+    assert np.isnan(df.corr(method=method).loc["a", "b"])
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.download import DownloadError, download_file, make_session
+
+CONTENT = bytes(range(256)) * 64
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Serves CONTENT with an ETag, honours Range, If-Range and If-None-Match.
+    requests = []
+
+    def do_GET(self) -> None:
+        self.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", ETAG) == ETAG:
+            start = int(range_header.removeprefix("bytes=").rstrip("-"))
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+                self.end_headers()
+                return
+
+        body = CONTENT[start:]
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    Handler.requests = []
+    yield f"http://127.0.0.1:{server.server_port}/FFCdb.xlsx"
+    server.shutdown()
+    server.server_close()
+
+
+def write_partial(path: str, url: str, data: bytes) -> None:
+    with open(f"{path}.part", "wb") as f:
+        f.write(data)
+    with open(f"{path}.meta.json", "w") as f:
+        json.dump({"partial": {"url": url, "etag": ETAG, "last_modified": None}}, f)
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_resumes_partial_download(url, tmp_path):
+    path = str(tmp_path / "FFCdb.xlsx")
+    write_partial(path, url, CONTENT[:1000])
+
+    assert download_file(url, path, checksum=f"md5:{hashlib.md5(CONTENT).hexdigest()}", session=make_session(retries=0))
+    assert read(path) == CONTENT
+    assert not os.path.exists(f"{path}.part")
+    assert Handler.requests[-1]["Range"] == "bytes=1000-"
+    assert Handler.requests[-1]["If-Range"] == ETAG
+
+
+def test_unchanged_file_is_not_downloaded_again(url, tmp_path):
+    path = str(tmp_path / "FFCdb.xlsx")
+    assert download_file(url, path, session=make_session(retries=0))
+    mtime = os.stat(path).st_mtime_ns
+
+    assert not download_file(url, path, session=make_session(retries=0))
+    assert Handler.requests[-1]["If-None-Match"] == ETAG
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_checksum_mismatch_removes_partial_file(url, tmp_path):
+    path = str(tmp_path / "FFCdb.xlsx")
+    with pytest.raises(DownloadError):
+        download_file(url, path, checksum="md5:0123456789abcdef0123456789abcdef", session=make_session(retries=0))
+
+    assert not os.path.exists(path)
+    assert not os.path.exists(f"{path}.part")
+    with open(f"{path}.meta.json", "r") as f:
+        assert "partial" not in json.load(f)
+
+
+def test_restarts_when_partial_file_is_too_large(url, tmp_path):
+    path = str(tmp_path / "FFCdb.xlsx")
+    write_partial(path, url, CONTENT + b"stale")
+
+    assert download_file(url, path, session=make_session(retries=0))
+    assert read(path) == CONTENT
+    assert [request.get("Range") for request in Handler.requests] == [f"bytes={len(CONTENT) + 5}-", None]
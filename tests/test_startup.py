@@ -0,0 +1,27 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmarks.startup import COMMANDS, ROOT, loaded_heavy_modules
+
+# Twice the benchmark's budget, the test should only catch an eager import
+# of a heavy dependency, not a slow machine.
+HELP_BUDGET = 1.0
+
+
+@pytest.mark.parametrize("command", [[]] + [[name] for name in COMMANDS], ids=lambda command: " ".join(command) or "start")
+def test_help_within_budget(command):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "start.py"] + command + ["--help"], cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith("usage:")
+    assert elapsed < HELP_BUDGET
+
+
+@pytest.mark.parametrize("module", ["start", "src.ffc_db"])
+def test_no_heavy_imports(module):
+    assert loaded_heavy_modules(module) == []